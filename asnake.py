@@ -1,7 +1,21 @@
+import atexit
+import bisect
+import cProfile
+import gc
+import itertools
+import json
 import logging
+import math
+import mmap
+import os
+import queue
 import random
-from collections import deque, defaultdict, namedtuple
-from typing import List, Optional, Dict, Tuple, Union, Any
+import struct
+import sys
+import threading
+import tracemalloc
+from collections import deque, defaultdict, namedtuple, OrderedDict
+from typing import List, Optional, Dict, Tuple, Union, Any, FrozenSet, Iterable, Sequence
 
 import time
 
@@ -9,6 +23,8 @@ from snakepit.robot_snake import RobotSnake
 
 
 logger = logging.getLogger('mysnake')
+# debug output of search nodes, it's left out of the search entirely unless enabled here
+DEBUG_SEARCH = False
 
 
 XY = namedtuple('XY', 'x y')
@@ -45,13 +61,22 @@ class Snake:
         prev_pos = self.head_history[0]
         return XY(self.head_pos.x - prev_pos.x, self.head_pos.y - prev_pos.y)
 
-    def copy(self):
-        copied = Snake(self.alive, self.head_pos, self.tail_pos, self.color)
+    def copy(self, pool: Optional['StatePool'] = None):
+        if pool is not None and pool.snakes:
+            copied = pool.snakes.pop()
+            copied.head_history.clear()
+            copied.head_history.extend(self.head_history)
+        else:
+            copied = Snake.__new__(Snake)
+            copied.head_history = self.head_history.copy()
+        copied.alive = self.alive
+        copied.head_pos = self.head_pos
+        copied.tail_pos = self.tail_pos
         copied.length = self.length
+        copied.color = self.color
         copied.grow_uncertain = self.grow_uncertain
         copied.grow = self.grow
         copied.score = self.score
-        copied.head_history = self.head_history.copy()
         return copied
 
     def __repr__(self):
@@ -99,13 +124,19 @@ GAME_CHARS = {
 
 
 class GameState:
-    __slots__ = 'world_size', 'world', 'snakes_by_color', 'my_snake', 'enemy_snake', 'frame_no'
+    """State of the game in one frame.
+
+    States derived for the search don't copy the world buffer. They store the parent state and the list of cell
+    changes instead, and the world is materialised only when it is read.
+    """
+    __slots__ = ('world_size', '_world', 'parent', 'deltas', 'snakes_by_color', 'my_snake', 'enemy_snake', 'frame_no',
+                 'pool')
 
     def __init__(self, world: Union[List[List[Tuple[str, int]]], 'GameState'], world_size: Optional[XY] = None,
                  snakes_by_color: Optional[Dict[int, Snake]] = None, frame_no: Optional[int] = None):
         if isinstance(world, GameState):
             self.world_size = world.world_size
-            self.world = bytearray(world.world)
+            self._world = bytearray(world.world)
             self.snakes_by_color = {k: v.copy() for k, v in world.snakes_by_color.items()}
             self.my_snake = None  # type: Optional[Snake]
             self.enemy_snake = None  # type: Optional[Snake]
@@ -116,17 +147,53 @@ class GameState:
             self.frame_no = world.frame_no
         else:
             self.world_size = world_size
-            self.world = bytearray(world_size.x * world_size.y)
+            self._world = bytearray(world_size.x * world_size.y)
             index = 0
             for y in range(self.world_size.y):
                 for x in range(self.world_size.x):
                     char, color = world[y][x]
-                    self.world[index] = GAME_CHARS[char] | (color << 5)
+                    self._world[index] = GAME_CHARS[char] | (color << 5)
                     index += 1
             self.snakes_by_color = snakes_by_color
             self.my_snake = None  # type: Optional[Snake]
             self.enemy_snake = None  # type: Optional[Snake]
             self.frame_no = frame_no
+        self.parent = None  # type: Optional[GameState]
+        self.deltas = None  # type: Optional[List[Tuple[int, int]]]
+        self.pool = None  # type: Optional[StatePool]
+
+    @property
+    def world(self) -> bytearray:
+        """The world buffer, materialised from the parent states and the cell changes on first access"""
+        world = self._world
+        if world is None:
+            # the states between the closest materialised ancestor and this one are materialised in order, in a loop,
+            # as the lines of states derived by a search can be long
+            lineage = []
+            state = self
+            while state._world is None:
+                lineage.append(state)
+                state = state.parent
+            world = state._world
+            for state in reversed(lineage):
+                if state.pool is None:
+                    world = bytearray(world)
+                else:
+                    world = state.pool.copy_world(world)
+                for index, value in state.deltas:
+                    if index < 0:
+                        # snake of color `value` died
+                        world = world.translate(self._dead_translation(value))
+                    else:
+                        world[index] = value
+                state._world = world
+        return world
+
+    @world.setter
+    def world(self, world: bytearray):
+        self._world = world
+        self.parent = None
+        self.deltas = None
 
     @staticmethod
     def _encode_value(value: Tuple[int, int]) -> int:
@@ -156,7 +223,10 @@ class GameState:
             return WORLD_STONE, 0
         if position.y < 0 or position.y >= self.world_size.y:
             return WORLD_STONE, 0
-        return self._decode_value(self.world[position.y * self.world_size.x + position.x])
+        world = self._world
+        if world is None:
+            world = self.world
+        return self._decode_value(world[position.y * self.world_size.x + position.x])
 
     def world_get2(self, position: Tuple[int, int]) -> Tuple[int, int]:
         """Get the state of world at given position.
@@ -170,7 +240,10 @@ class GameState:
             return WORLD_STONE, 0
         if position_y < 0 or position_y >= self.world_size.y:
             return WORLD_STONE, 0
-        return self._decode_value(self.world[position_y * self.world_size.x + position_x])
+        world = self._world
+        if world is None:
+            world = self.world
+        return self._decode_value(world[position_y * self.world_size.x + position_x])
 
     def world_set(self, position: XY, value: Tuple[int, int]):
         """Set the state of world at given position.
@@ -181,7 +254,12 @@ class GameState:
             return
         if position.y < 0 or position.y >= self.world_size.y:
             return
-        self.world[position.y * self.world_size.x + position.x] = self._encode_value(value)
+        index = position.y * self.world_size.x + position.x
+        encoded = self._encode_value(value)
+        if self.deltas is not None:
+            self.deltas.append((index, encoded))
+        if self._world is not None:
+            self._world[index] = encoded
 
     def trace_snake_path(self, start_pos: XY) -> List[XY]:
         """Given a head or tail position of the snake, find the segments of the path until they can be uniquely followed.
@@ -215,8 +293,37 @@ class GameState:
 
         return segments
 
-    def mark_dead(self, dead_color: int):
-        trans = bytes.maketrans(bytes([
+    def derive(self, changed_colors: Iterable[int], pool: Optional['StatePool'] = None) -> 'GameState':
+        """Copy the state, copying only the snakes of the given colors and sharing the others with this state
+
+        The world is not copied, the new state records changes to it instead.
+
+        :param pool: if given, the new state and snakes are taken from the pool where possible
+        """
+        if pool is not None and pool.game_states:
+            new_state = pool.game_states.pop()
+            new_state.deltas.clear()
+            snakes_by_color = new_state.snakes_by_color
+            snakes_by_color.clear()
+            snakes_by_color.update(self.snakes_by_color)
+        else:
+            new_state = GameState.__new__(GameState)
+            new_state.deltas = []
+            snakes_by_color = new_state.snakes_by_color = self.snakes_by_color.copy()
+        new_state.world_size = self.world_size
+        new_state._world = None
+        new_state.parent = self
+        new_state.pool = pool
+        for color in changed_colors:
+            snakes_by_color[color] = snakes_by_color[color].copy(pool)
+        new_state.my_snake = None if self.my_snake is None else snakes_by_color[self.my_snake.color]
+        new_state.enemy_snake = None if self.enemy_snake is None else snakes_by_color[self.enemy_snake.color]
+        new_state.frame_no = self.frame_no
+        return new_state
+
+    @staticmethod
+    def _dead_translation(dead_color: int) -> bytes:
+        return bytes.maketrans(bytes([
             WORLD_HEAD | (dead_color << 5),
             WORLD_BODY | (dead_color << 5),
             WORLD_TAIL | (dead_color << 5),
@@ -225,12 +332,204 @@ class GameState:
             WORLD_DEAD_BODY,
             WORLD_DEAD_TAIL,
         ]))
-        self.world = self.world.translate(trans)
+
+    def mark_dead(self, dead_color: int):
+        if self.deltas is not None:
+            self.deltas.append((-1, dead_color))
+        if self._world is not None:
+            self._world = self._world.translate(self._dead_translation(dead_color))
         self.snakes_by_color[dead_color].alive = False
 
 
+class StatePool:
+    """Free lists of game states, snakes and world buffers that the search reuses instead of allocating new ones.
+
+    A search releases a derived state once it is done with its subtree. The state must not be used afterwards,
+    and all the states derived from it must have been released before.
+    """
+    __slots__ = 'game_states', 'snakes', 'worlds'
+
+    def __init__(self):
+        self.game_states = []  # type: List[GameState]
+        self.snakes = []  # type: List[Snake]
+        self.worlds = []  # type: List[bytearray]
+
+    def release(self, state: GameState):
+        """Return a derived state, the snakes it copied and its world buffer to the pool"""
+        parent_snakes = state.parent.snakes_by_color
+        for color, snake in state.snakes_by_color.items():
+            if parent_snakes[color] is not snake:
+                self.snakes.append(snake)
+        if state._world is not None:
+            self.worlds.append(state._world)
+            state._world = None
+        state.parent = None
+        state.my_snake = None
+        state.enemy_snake = None
+        self.game_states.append(state)
+
+    def copy_world(self, world: bytearray) -> bytearray:
+        """Return a copy of the world buffer, reusing a released buffer of the same size if there is one"""
+        if self.worlds:
+            buffer = self.worlds.pop()
+            if len(buffer) == len(world):
+                buffer[:] = world
+                return buffer
+        return bytearray(world)
+
+    def __len__(self):
+        return len(self.game_states) + len(self.snakes) + len(self.worlds)
+
+
+# translation of world bytes to 1 for positions that never become free (stones and dead snakes), 0 otherwise
+STATIC_OBSTACLES = bytes(1 if byte & 0x1f >= WORLD_DEAD_TAIL else 0 for byte in range(256))
+
+
+class MoveGenerator:
+    """Generates moves that don't run into walls, stones or dead snakes of the searched game state.
+
+    These obstacles stay in place during the search (except for snakes dying in the searched future, which
+    advance_game takes care of), so the moves are computed once per head position and direction.
+    """
+    __slots__ = 'state', 'size_x', 'size_y', 'blocked', 'cache'
+
+    def __init__(self, state: GameState):
+        self.state = state  # the root of the search this generator was made for
+        self.size_x, self.size_y = state.world_size
+        self.blocked = state.world.translate(STATIC_OBSTACLES)
+        self.cache = {}  # type: Dict[Tuple[XY, Optional[XY]], Tuple[XY, ...]]
+
+    def moves(self, snake: Snake) -> Tuple[XY, ...]:
+        """Return the moves that don't go backwards or into static obstacles.
+
+        If all the moves are suicidal, a single move is returned, so that the search still has a child to evaluate.
+        """
+        head_pos = snake.head_pos
+        previous_pos = snake.head_history[0] if snake.head_history else None
+        key = (head_pos, previous_pos)
+        moves = self.cache.get(key)
+        if moves is None:
+            candidates = [move for move in (DIR_UP, DIR_RIGHT, DIR_DOWN, DIR_LEFT)
+                          if previous_pos is None or
+                          (head_pos.x + move.x != previous_pos.x or head_pos.y + move.y != previous_pos.y)]
+            moves = tuple(move for move in candidates if self.is_free(head_pos.x + move.x, head_pos.y + move.y))
+            if not moves:
+                moves = (candidates[0],)
+            self.cache[key] = moves
+        return moves
+
+    def is_free(self, x: int, y: int) -> bool:
+        return 0 <= x < self.size_x and 0 <= y < self.size_y and not self.blocked[y * self.size_x + x]
+
+
 class SearchTimedOut(Exception):
-    pass
+    def __init__(self, best_score: Any = None, best_move: Optional[XY] = None, explored_states: int = 0):
+        super(SearchTimedOut, self).__init__()
+        # the best of the root moves that were searched completely before the search timed out, if any
+        self.best_score = best_score
+        self.best_move = best_move
+        self.explored_states = explored_states
+
+
+class Clock:
+    """Wall clock the time limits of ticks and searches are measured with.
+
+    Loops that run until a deadline report the nodes they process with count(), which the wall clock ignores.
+    """
+    __slots__ = ()
+
+    def now(self) -> float:
+        return time.monotonic()
+
+    def count(self, nodes: float):
+        pass
+
+
+NODE_CLOCK_SECONDS_PER_NODE = 0.00003  # about the time of a search node on a fast machine
+SCAN_NODE_COST = 0.1  # cost of a position visited by the BFS or a step of the survival planner, in search nodes
+
+
+class NodeClock(Clock):
+    """Virtual clock that advances only by the counted nodes, seconds_per_node for each.
+
+    The same position under the same time limit explores the same nodes on any machine and in any run, so search
+    depths and decisions can be compared, while the node rate is measured separately in wall time.
+    """
+    __slots__ = 'time', 'seconds_per_node'
+
+    def __init__(self, seconds_per_node: float = NODE_CLOCK_SECONDS_PER_NODE):
+        self.time = 0.0
+        self.seconds_per_node = seconds_per_node
+
+    def now(self) -> float:
+        return self.time
+
+    def count(self, nodes: float):
+        self.time += nodes * self.seconds_per_node
+
+
+WALL_CLOCK = Clock()
+
+DEADLINE_CHECK_PERIOD = 0.0002  # target time between clock reads when polling a deadline
+
+
+class Deadline:
+    """Deadline polled by counting nodes, so that the clock is read only every few nodes.
+
+    Call sites poll it with node_expired() or check_node() for every node, which call expired() only once countdown
+    drops to zero. The number of nodes between clock reads adapts to the measured node rate, so that the clock is read
+    about every DEADLINE_CHECK_PERIOD seconds.
+    """
+    __slots__ = 'time', 'clock', 'node_cost', 'countdown', 'interval', 'counted', 'last_check_time', 'overshoot'
+
+    def __init__(self, deadline_time: float, clock: Clock = WALL_CLOCK, node_cost: float = 1.0):
+        self.time = deadline_time
+        self.clock = clock
+        self.node_cost = node_cost  # nodes counted on the clock for each polled node
+        self.countdown = 1
+        self.interval = 1  # nodes between clock reads
+        self.counted = 0  # nodes of the current interval already counted on the clock by flush()
+        self.last_check_time = clock.now()
+        self.overshoot = None  # type: Optional[float]  # how late the deadline was noticed
+
+    def flush(self):
+        """Count the nodes processed since the last clock read on the clock, e.g. when a search is done"""
+        nodes = self.interval - self.countdown - self.counted
+        self.clock.count(nodes * self.node_cost)
+        self.counted += nodes
+
+    def expired(self) -> bool:
+        """Read the clock, return True if the deadline has passed and plan the next clock read"""
+        self.flush()
+        self.counted = 0
+        now = self.clock.now()
+        if now >= self.time:
+            if self.overshoot is None:
+                self.overshoot = now - self.time
+            self.countdown = 1
+            self.interval = 1
+            return True
+        elapsed = now - self.last_check_time
+        # read the clock more often close to the deadline, and grow the interval at most twice per read,
+        # so that a sudden change of node rate is noticed quickly
+        period = min(DEADLINE_CHECK_PERIOD, self.time - now)
+        if elapsed * 2 < period:
+            self.interval *= 2
+        else:
+            self.interval = max(1, int(self.interval * period / elapsed))
+        self.countdown = self.interval
+        self.last_check_time = now
+        return False
+
+    def node_expired(self) -> bool:
+        """Count a node, return True if the deadline has passed (the clock is read only every interval nodes)"""
+        self.countdown -= 1
+        return self.countdown <= 0 and self.expired()
+
+    def check_node(self):
+        """Count a node, raise SearchTimedOut if the deadline has passed"""
+        if self.node_expired():
+            raise SearchTimedOut()
 
 
 BFSPosition = namedtuple('BFSPosititon', ('position', 'partition_size', 'food_score'))
@@ -238,18 +537,712 @@ BFSResult = namedtuple('BFSResult', ('position_stats', 'fully_explored_distance'
 Heuristic = namedtuple('Heuristic', ('game_result', 'liveness', 'entering_small_partition', 'score', 'food_score',
                                      'partition_size', 'depth'))
 
+# Layout of Heuristic packed to a single integer, most significant field first.
+# Each field is stored as int(value * scale) + offset, clamped to the given number of bits, so that comparing
+# the packed integers gives the same order as comparing the tuples (up to the quantisation of food_score).
+HEURISTIC_PACKING = (
+    # field, bits, offset, scale
+    ('game_result', 2, 1, 1),
+    ('liveness', 2, 1, 1),
+    ('entering_small_partition', 2, 1, 1),
+    ('score', 32, 1 << 31, 1),
+    ('food_score', 32, 0, 1024),
+    ('partition_size', 24, 0, 1),
+    ('depth', 8, 1 << 7, 1),
+)
+
+
+def pack_heuristic(heuristic: Heuristic) -> int:
+    """Encode the heuristic as a single integer that compares the same way as the tuple"""
+    packed = 0
+    for field, bits, offset, scale in HEURISTIC_PACKING:
+        value = int(getattr(heuristic, field) * scale) + offset
+        packed = (packed << bits) | min(max(value, 0), (1 << bits) - 1)
+    return packed
+
+
+def unpack_heuristic(packed: int) -> Heuristic:
+    """Decode a packed heuristic to the named fields, for debugging"""
+    fields = {}
+    for field, bits, offset, scale in reversed(HEURISTIC_PACKING):
+        value = (packed & ((1 << bits) - 1)) - offset
+        fields[field] = value / scale if scale != 1 else value
+        packed >>= bits
+    return Heuristic(**fields)
+
+
+SurvivalPlan = namedtuple('SurvivalPlan', ('region', 'path'))
+
+
+class HeuristicCache:
+    """Bounded cache of heuristic values, evicting the least recently used entries"""
+
+    def __init__(self, max_size: int = 4096):
+        self.max_size = max_size
+        self.entries = OrderedDict()  # type: OrderedDict
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Tuple) -> Any:
+        """Return the cached value or None"""
+        value = self.entries.get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.entries.move_to_end(key)
+        return value
+
+    def put(self, key: Tuple, value: Any):
+        self.entries[key] = value
+        if len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def reset_stats(self):
+        self.hits = 0
+        self.misses = 0
+
+
+TIME_SAFETY_FRACTION = 0.75  # part of the frame interval we may use, the rest is left for replies, etc.
+TIME_LIMIT_CEILING = 0.75 * (1 / 9.0)  # the slowest frame rate of the game
+TIME_LIMIT_FLOOR = 0.002
+TIME_SAMPLES = 32  # number of recent ticks the estimates are based on
+
+
+class TimeManager:
+    """Sets the time limit of each tick from the measured interval between ticks and our own reply latency"""
+    __slots__ = 'intervals', 'overruns', 'last_tick_start', 'last_frame_time', 'last_frame_no', 'time_limit'
+
+    def __init__(self, samples: int = TIME_SAMPLES):
+        self.intervals = deque(maxlen=samples)  # type: deque
+        self.overruns = deque(maxlen=samples)  # type: deque
+        self.last_tick_start = None  # type: Optional[float]
+        self.last_frame_time = None  # type: Optional[float]
+        self.last_frame_no = None  # type: Optional[int]
+        self.time_limit = None  # type: Optional[float]
+
+    @staticmethod
+    def default_time_limit(frame_no: int) -> float:
+        """Time limit used until the frame interval is measured"""
+        # the frame rate is 9 at the beginning and goes up to 60 later
+        # so we can run deeper searches in the first 1024 frames (we use 1000 to have some buffer)
+        if frame_no < 1024:
+            return TIME_SAFETY_FRACTION * (1 / 9.0)
+        return TIME_SAFETY_FRACTION * (1 / 60.0)
+
+    def frame_interval(self) -> Optional[float]:
+        """Estimate of the frame interval, or None if not measured yet
+
+        A low quantile is used, so that frames that arrived late don't raise the estimate.
+        """
+        if len(self.intervals) < 2:
+            return None
+        return sorted(self.intervals)[len(self.intervals) // 4]
+
+    def start_tick(self, now: float, frame_no: int, frame_time: Optional[float] = None) -> float:
+        """Record the start of a tick and return its time limit in seconds
+
+        :param now: time of the clock the time limit is kept by
+        :param frame_no: number of the game frame, counting also the frames we missed (see observe_state_changes)
+        :param frame_time: wall time of the start of the tick, if the time limit is kept by a virtual clock; the frames
+                           arrive in wall time, so their interval is measured by it
+        """
+        if frame_time is None:
+            frame_time = now
+        if self.last_frame_time is not None:
+            # the frames we missed while replying (or that the game skipped) are in the interval too
+            self.intervals.append((frame_time - self.last_frame_time) / max(1, frame_no - self.last_frame_no))
+        self.last_frame_time = frame_time
+        self.last_frame_no = frame_no
+        self.last_tick_start = now
+        interval = self.frame_interval()
+        if interval is None:
+            time_limit = self.default_time_limit(frame_no)
+        else:
+            # the time we spend in a tick over its limit (reply, logging, deadline overshoot) is kept as a margin
+            margin = max(self.overruns, default=0.0)
+            time_limit = TIME_SAFETY_FRACTION * interval - margin
+        self.time_limit = min(TIME_LIMIT_CEILING, max(TIME_LIMIT_FLOOR, time_limit))
+        return self.time_limit
+
+    def end_tick(self, now: float):
+        """Record that the reply of the tick is ready"""
+        self.overruns.append(max(0.0, now - self.last_tick_start - self.time_limit))
+
+
+# upper bounds of histogram buckets, values over the last bound are counted in an extra bucket
+MILLISECOND_BUCKETS = (0.05, 0.1, 0.2, 0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+COUNT_BUCKETS = tuple(2 ** exponent for exponent in range(21))
+STEP_BUCKETS = tuple(range(65))
+
+
+class Histogram:
+    """Counts of values in fixed buckets"""
+    __slots__ = 'bounds', 'counts', 'count', 'total', 'max'
+
+    def __init__(self, bounds: Sequence[float]):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0
+        self.max = None
+
+    def add(self, value: float):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def quantile(self, fraction: float) -> Optional[float]:
+        """Return the upper bound of the bucket containing the given quantile (max for the overflow bucket)"""
+        if self.count == 0:
+            return None
+        rank = fraction * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count > 0:
+                return self.bounds[index] if index < len(self.bounds) else self.max
+        return self.max
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            'count': self.count,
+            'mean': self.total / self.count if self.count else None,
+            'max': self.max,
+            'p50': self.quantile(0.5),
+            'p90': self.quantile(0.9),
+            'p99': self.quantile(0.99),
+            'bounds': list(self.bounds),
+            'counts': list(self.counts),
+        }
+
+
+class Telemetry:
+    """Histograms of per-tick statistics (phase durations, node counts, search depth, ...)"""
+    METRIC_BUCKETS = {
+        'tick_ms': MILLISECOND_BUCKETS,
+        'observe_ms': MILLISECOND_BUCKETS,
+        'bfs_ms': MILLISECOND_BUCKETS,
+        'search_ms': MILLISECOND_BUCKETS,
+        'overshoot_ms': MILLISECOND_BUCKETS,
+        'search_states': COUNT_BUCKETS,
+        'search_depth': STEP_BUCKETS,
+        'bfs_distance': STEP_BUCKETS,
+        # recorded only when memory tracing is enabled
+        'observe_peak_kib': COUNT_BUCKETS,
+        'bfs_peak_kib': COUNT_BUCKETS,
+        'search_peak_kib': COUNT_BUCKETS,
+        'observe_blocks': COUNT_BUCKETS,
+        'bfs_blocks': COUNT_BUCKETS,
+        'search_blocks': COUNT_BUCKETS,
+        'live_game_states': COUNT_BUCKETS,
+        'live_snakes': COUNT_BUCKETS,
+    }
+
+    def __init__(self):
+        self.ticks = 0
+        self.histograms = {name: Histogram(bounds)
+                           for name, bounds in self.METRIC_BUCKETS.items()}  # type: Dict[str, Histogram]
+        self.writer = None  # type: Optional[threading.Thread]
+
+    def record(self, name: str, value: float):
+        self.histograms[name].add(value)
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {'ticks': self.ticks,
+                'histograms': {name: histogram.as_dict() for name, histogram in self.histograms.items()}}
+
+    def dump(self, path: str):
+        """Write the telemetry to the given file as JSON"""
+        self.write(path, self.as_dict())
+
+    def dump_in_background(self, path: str):
+        """Write a snapshot of the telemetry to the given file as JSON from a thread, so that ticks don't wait for it
+
+        The previous write is waited for first, so that an older snapshot can't overwrite a newer one. The thread
+        isn't a daemon, so the interpreter waits for the last write at exit.
+        """
+        if self.writer is not None:
+            self.writer.join()
+        self.writer = threading.Thread(target=self.write, args=(path, self.as_dict()), name='telemetry-writer')
+        self.writer.start()
+
+    @staticmethod
+    def write(path: str, telemetry: Dict[str, Any]):
+        with open(path, 'w') as f:
+            json.dump(telemetry, f, indent=2)
+
+
+LIVE_OBJECTS_COUNT_EVERY = 50  # ticks between counts of live objects by the memory tracer
+
+
+class MemoryTracer:
+    """Measures memory allocated by the phases of a tick with tracemalloc.
+
+    For each phase, the peak of memory allocated above the memory at the start of the phase, and the change of the
+    number of allocated memory blocks is recorded to telemetry. Live objects are counted only every count_every ticks,
+    as that walks all the objects tracked by the garbage collector.
+    """
+
+    def __init__(self, telemetry: Telemetry, count_every: int = LIVE_OBJECTS_COUNT_EVERY):
+        self.telemetry = telemetry
+        self.count_every = count_every
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        self.start_memory = 0
+        self.start_blocks = 0
+
+    def begin(self):
+        tracemalloc.reset_peak()
+        self.start_memory = tracemalloc.get_traced_memory()[0]
+        self.start_blocks = sys.getallocatedblocks()
+
+    def end(self, phase: str):
+        current_memory, peak_memory = tracemalloc.get_traced_memory()
+        peak_kib = (peak_memory - self.start_memory) / 1024
+        blocks = sys.getallocatedblocks() - self.start_blocks
+        self.telemetry.record(phase + '_peak_kib', peak_kib)
+        self.telemetry.record(phase + '_blocks', blocks)
+        logger.info('Memory of %s: peak %.1f KiB, %+.1f KiB retained, %+d blocks', phase, peak_kib,
+                    (current_memory - self.start_memory) / 1024, blocks)
+
+    def count_live_objects(self):
+        """Record the number of game states and snakes alive at the end of a tick"""
+        game_states = 0
+        snakes = 0
+        for obj in gc.get_objects():
+            if type(obj) is GameState:
+                game_states += 1
+            elif type(obj) is Snake:
+                snakes += 1
+        self.telemetry.record('live_game_states', game_states)
+        self.telemetry.record('live_snakes', snakes)
+        logger.info('Live objects: %d game states, %d snakes', game_states, snakes)
+
+
+GC_FULL_COLLECTION_EVERY = 64  # ticks between collections of the oldest generation
+
+
+class GCScheduler:
+    """Keeps the cyclic garbage collector from running during ticks and collects the garbage between ticks.
+
+    Searches create lots of short-lived objects (and reference cycles of the closures in advance_game), so automatic
+    collections would run in the middle of the search. Instead, the collector is disabled during a tick and a
+    background thread collects right after the tick returns its move, while we wait for the next frame.
+
+    The collector is global, so the robots of a process share one scheduler, see shared().
+    """
+
+    def __init__(self):
+        self.ticks = 0
+        self.pending = threading.Event()
+        self.idle = threading.Event()  # set when no collection is running
+        self.idle.set()
+        self.collector = None  # type: Optional[threading.Thread]
+        # objects created at startup (modules, the robot) live for the whole game, no need to scan them again
+        gc.collect()
+        gc.freeze()
+
+    @staticmethod
+    def shared() -> 'GCScheduler':
+        """Return the scheduler of this process, creating it (and freezing the objects created so far) once"""
+        global shared_gc_scheduler
+        if shared_gc_scheduler is None:
+            shared_gc_scheduler = GCScheduler()
+        return shared_gc_scheduler
+
+    def start_tick(self):
+        self.idle.wait()
+        gc.disable()
+
+    def end_tick(self):
+        self.ticks += 1
+        self.idle.clear()
+        if self.collector is None:
+            self.collector = threading.Thread(target=self.collect, name='idle-gc', daemon=True)
+            self.collector.start()
+        self.pending.set()
+
+    def collect(self):
+        """Body of the collector thread"""
+        while True:
+            self.pending.wait()
+            self.pending.clear()
+            gc.collect(2 if self.ticks % GC_FULL_COLLECTION_EVERY == 0 else 1)
+            gc.enable()
+            self.idle.set()
+
+
+shared_gc_scheduler = None  # type: Optional[GCScheduler]
+
+
+PROFILE_EVERY = 100  # ticks between ticks profiled with cProfile
+PROFILE_SAMPLE_INTERVAL = 0.001  # seconds between stack samples of the sampling profiler
+PROFILE_MAX_FILES = 200  # the oldest profiles are removed to keep at most this many files
+
+
+class TickProfiler:
+    """Profiles ticks of the bot and writes the profiles to a directory.
+
+    Every `every`-th tick is profiled with cProfile and written as pstats. The stack of the ticking thread is also
+    sampled in the background during every tick, and the samples are written as collapsed stacks (the input of
+    flamegraph.pl) for the ticks profiled by cProfile and for any tick over its time limit.
+    """
+
+    def __init__(self, directory: str, every: int = PROFILE_EVERY, max_files: int = PROFILE_MAX_FILES,
+                 sample_interval: float = PROFILE_SAMPLE_INTERVAL):
+        self.directory = directory
+        self.every = every
+        self.max_files = max_files
+        self.sample_interval = sample_interval
+        self.files = deque()  # type: deque
+        self.profile = None  # type: Optional[cProfile.Profile]
+        self.samples = defaultdict(int)  # type: Dict[Tuple[str, ...], int]
+        self.samples_lock = threading.Lock()
+        self.thread_id = None  # type: Optional[int]
+        self.sampling = threading.Event()
+        self.sampler = None  # type: Optional[threading.Thread]
+        self.switch_interval = None  # type: Optional[float]
+        os.makedirs(directory, exist_ok=True)
+
+    def start(self, frame_no: int):
+        if self.every > 0 and frame_no % self.every == 0:
+            self.profile = cProfile.Profile()
+            self.profile.enable()
+        self.thread_id = threading.get_ident()
+        with self.samples_lock:
+            self.samples = defaultdict(int)
+        if self.sampler is None:
+            self.sampler = threading.Thread(target=self.sample, name='tick-sampler', daemon=True)
+            self.sampler.start()
+        # the sampler thread gets to run only when the ticking thread releases GIL
+        self.switch_interval = sys.getswitchinterval()
+        sys.setswitchinterval(self.sample_interval)
+        self.sampling.set()
+
+    def stop(self, frame_no: int, over_limit: bool):
+        self.sampling.clear()
+        sys.setswitchinterval(self.switch_interval)
+        with self.samples_lock:
+            samples = self.samples
+            self.samples = defaultdict(int)
+        tag = 'tick-{:06d}'.format(frame_no)
+        if self.profile is not None:
+            self.profile.disable()
+            self.write(tag + '.pstats', lambda path: self.profile.dump_stats(path))
+            self.profile = None
+            over_limit = True
+        if over_limit and samples:
+            lines = self.collapse(samples, tag)
+            self.write(tag + '.folded', lambda path: self.write_lines(path, lines))
+
+    def sample(self):
+        """Body of the sampler thread"""
+        while True:
+            self.sampling.wait()
+            time.sleep(self.sample_interval)
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None or not self.sampling.is_set():
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append('{}:{}'.format(os.path.basename(code.co_filename), code.co_name))
+                frame = frame.f_back
+            del frame
+            with self.samples_lock:
+                self.samples[tuple(reversed(stack))] += 1
+
+    @staticmethod
+    def collapse(samples: Dict[Tuple[str, ...], int], tag: str) -> List[str]:
+        """Format stack samples as collapsed stacks, with the tag as the root frame"""
+        return ['{};{} {}'.format(tag, ';'.join(stack), count) for stack, count in sorted(samples.items())]
+
+    @staticmethod
+    def write_lines(path: str, lines: List[str]):
+        with open(path, 'w') as f:
+            for line in lines:
+                f.write(line + '\n')
+
+    def write(self, name: str, writer):
+        """Write a file using the writer and remove the oldest files over the limit"""
+        path = os.path.join(self.directory, name)
+        writer(path)
+        self.files.append(path)
+        while len(self.files) > self.max_files:
+            try:
+                os.remove(self.files.popleft())
+            except OSError:
+                pass
+
+
+RECORD_MAGIC = b'ASNAKREC'
+RECORD_VERSION = 1
+RECORD_FILE_HEADER = struct.Struct('<8sI')  # magic, version
+# record size (including the header and the world), frame number, world size x and y, my color, move x and y,
+# search depth, tick time and search time in ms, explored states; followed by the world bytes of GameState
+RECORD_FRAME_HEADER = struct.Struct('<IIHHBbbBffI')
+RECORD_INDEX_SUFFIX = '.idx'  # the index file holds the offset of each frame record as 64-bit integer
+RECORD_INDEX_ENTRY = struct.Struct('<Q')
+
+RecordedFrame = namedtuple('RecordedFrame', ('frame_no', 'world_size', 'color', 'move', 'search_depth', 'tick_ms',
+                                             'search_ms', 'explored_states', 'world'))
+
+
+class GameRecorder:
+    """Appends the observed worlds and decisions of the bot to a binary file, see GameRecording for reading it.
+
+    The frames are packed and written by a background thread, so that file I/O stays out of the ticks. The offsets of
+    the frames are written to an index file next to the recording (the path with RECORD_INDEX_SUFFIX). A recorder that
+    is not closed is closed at interpreter exit, so that the queued frames are not lost.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.queue = queue.Queue()  # type: queue.Queue
+        self.file = open(path, 'wb')
+        self.index_file = open(path + RECORD_INDEX_SUFFIX, 'wb')
+        self.file.write(RECORD_FILE_HEADER.pack(RECORD_MAGIC, RECORD_VERSION))
+        self.offset = RECORD_FILE_HEADER.size
+        self.finished = False  # true once no more frames are queued
+        self.writer = threading.Thread(target=self.write_frames, name='game-recorder', daemon=True)
+        self.writer.start()
+        atexit.register(self.close)
+
+    def record(self, frame_no: int, world_size: XY, color: int, world: bytes, move: Optional[XY],
+               search_depth: int = 0, tick_ms: float = 0.0, search_ms: float = 0.0, explored_states: int = 0):
+        """Queue a frame for writing, the world must not be modified afterwards (pass a bytes copy)"""
+        self.queue.put((frame_no, world_size, color, world, move, search_depth, tick_ms, search_ms,
+                        explored_states))
+
+    def write_frames(self):
+        """Body of the writer thread"""
+        while True:
+            frame = self.queue.get()
+            if frame is None:
+                break
+            frame_no, world_size, color, world, move, search_depth, tick_ms, search_ms, explored_states = frame
+            size = RECORD_FRAME_HEADER.size + len(world)
+            self.file.write(RECORD_FRAME_HEADER.pack(size, frame_no, world_size.x, world_size.y, color,
+                                                     move.x if move is not None else 0,
+                                                     move.y if move is not None else 0,
+                                                     min(search_depth, 255), tick_ms, search_ms, explored_states))
+            self.file.write(world)
+            self.index_file.write(RECORD_INDEX_ENTRY.pack(self.offset))
+            self.offset += size
+            if self.queue.empty():
+                # the recording is readable up to here; the index goes after the data it points to
+                self.file.flush()
+                self.index_file.flush()
+        self.file.close()
+        self.index_file.close()
+
+    def finish(self):
+        """Let the writer thread close the files after the queued frames, without waiting for it"""
+        if not self.finished:
+            self.finished = True
+            self.queue.put(None)
+
+    def close(self):
+        """Write the queued frames and close the files"""
+        atexit.unregister(self.close)
+        self.finish()
+        self.writer.join()
+
+
+class GameRecording:
+    """Frames of a file written by GameRecorder.
+
+    The file is memory-mapped and the world of a frame is a memoryview of the mapping, so loading any frame doesn't
+    read or copy the frames before it. Frames written after the recording was opened are not visible.
+    """
+
+    def __init__(self, path: str):
+        with open(path, 'rb') as f:
+            self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.view = memoryview(self.mmap)
+        magic, version = RECORD_FILE_HEADER.unpack_from(self.view, 0)
+        if magic != RECORD_MAGIC or version != RECORD_VERSION:
+            self.close()
+            raise ValueError('{} is not a game recording of version {}'.format(path, RECORD_VERSION))
+        try:
+            with open(path + RECORD_INDEX_SUFFIX, 'rb') as f:
+                index = f.read()
+        except FileNotFoundError:
+            self.offsets = self.scan()
+        else:
+            # a recording that was not closed may end with an incomplete frame
+            self.offsets = [offset for offset, in RECORD_INDEX_ENTRY.iter_unpack(
+                                index[:len(index) - len(index) % RECORD_INDEX_ENTRY.size])
+                            if self.complete(offset)]
+
+    def complete(self, offset: int) -> bool:
+        """Return True if the whole frame record at offset is in the file"""
+        if offset + RECORD_FRAME_HEADER.size > len(self.view):
+            return False
+        # a record that was not written yet (e.g. the zero-filled end of a file after a crash) can't be smaller
+        size = RECORD_FRAME_HEADER.unpack_from(self.view, offset)[0]
+        return RECORD_FRAME_HEADER.size <= size and offset + size <= len(self.view)
+
+    def scan(self) -> List[int]:
+        """Find the offsets of the frames by walking the records, for recordings without index"""
+        offsets = []
+        offset = RECORD_FILE_HEADER.size
+        while self.complete(offset):
+            offsets.append(offset)
+            offset += RECORD_FRAME_HEADER.unpack_from(self.view, offset)[0]
+        return offsets
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __getitem__(self, index: int) -> RecordedFrame:
+        offset = self.offsets[index]
+        size, frame_no, size_x, size_y, color, move_x, move_y, search_depth, tick_ms, search_ms, explored_states = \
+            RECORD_FRAME_HEADER.unpack_from(self.view, offset)
+        move = XY(move_x, move_y) if move_x or move_y else None
+        world = self.view[offset + RECORD_FRAME_HEADER.size:offset + size]
+        return RecordedFrame(frame_no, XY(size_x, size_y), color, move, search_depth, tick_ms, search_ms,
+                             explored_states, world)
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def close(self):
+        """Unmap the file, or leave it mapped until the worlds of the loaded frames are released"""
+        self.view.release()
+        try:
+            self.mmap.close()
+        except BufferError:
+            pass  # the mapping is closed when the last world referencing it is garbage collected
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+recording_numbers = itertools.count(1)  # distinguishes recordings started by one process in the same second
+
+
+def env_flag(name: str) -> bool:
+    """Return True if the environment variable is set to anything but an empty string or 0"""
+    return os.environ.get(name, '') not in ('', '0')
+
+
+SEARCH_MINIMAX = 'minimax'  # two-player max-min against enemy_snake, other snakes don't move
+SEARCH_PARANOID = 'paranoid'  # all enemies in reach play against me, with alpha-beta pruning
+SEARCH_MAXN = 'maxn'  # every snake in reach maximizes its own heuristic
+SEARCH_MCTS = 'mcts'  # anytime Monte Carlo tree search with decoupled UCT
+
+MCTS_EXPLORATION = 0.7  # UCB1 exploration constant
+MCTS_PLAYOUT_DEPTH = 4  # number of random ticks simulated before the heuristic cutoff
+MCTS_REACH = 4  # enemies whose heads are farther apart than twice this distance do not branch in the tree
+
+
+class MCTSNode:
+    """Node of the Monte Carlo search tree with decoupled move statistics for each branching snake"""
+    __slots__ = 'state', 'terminal', 'colors', 'moves', 'move_visits', 'move_totals', 'visits', 'children'
+
+    def __init__(self, state: GameState, terminal: bool, snakes: List[Snake], moves: List[Tuple[XY, ...]]):
+        self.state = state
+        self.terminal = terminal  # if true, the node is evaluated by heuristic and never expanded
+        self.colors = [snake.color for snake in snakes]  # snakes that branch in this node, my snake first
+        self.moves = moves  # possible moves of each of the snakes
+        self.move_visits = [[0] * len(moves) for moves in self.moves]
+        self.move_totals = [[0.0] * len(moves) for moves in self.moves]
+        self.visits = 0
+        self.children = {}  # type: Dict[Tuple[int, ...], MCTSNode]  # from tuple of move indexes
+
+    def select(self, exploration: float) -> Tuple[int, ...]:
+        """Select a move for each snake independently using UCB1"""
+        log_visits = math.log(self.visits) if self.visits > 0 else 0.0
+        joint_move = []
+        for visits, totals in zip(self.move_visits, self.move_totals):
+            best_index = 0
+            best_value = None
+            for index, (move_visits, move_total) in enumerate(zip(visits, totals)):
+                if move_visits == 0:
+                    best_index = index
+                    break
+                value = move_total / move_visits + exploration * math.sqrt(log_visits / move_visits)
+                if best_value is None or value > best_value:
+                    best_index = index
+                    best_value = value
+            joint_move.append(best_index)
+        return tuple(joint_move)
+
+    def update(self, joint_move: Tuple[int, ...], my_value: float):
+        """Record the result of a playout, enemies get the complement of my value"""
+        self.visits += 1
+        for player, move_index in enumerate(joint_move):
+            self.move_visits[player][move_index] += 1
+            self.move_totals[player][move_index] += my_value if player == 0 else 1.0 - my_value
+
 
 class MyRobotSnake(RobotSnake):
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, search_mode: str = SEARCH_MINIMAX, packed_scores: bool = False,
+                 telemetry_path: Optional[str] = None, telemetry_every: int = 0,
+                 profile_dir: Optional[str] = None, profile_every: Optional[int] = None,
+                 trace_memory: Optional[bool] = None, schedule_gc: Optional[bool] = None,
+                 record_dir: Optional[str] = None, clock: Clock = WALL_CLOCK, **kwargs):
         super(MyRobotSnake, self).__init__(*args, **kwargs)
         self.old_state = None  # type: Optional[GameState]
         self.frame_no = 0
+        self.search_mode = search_mode
+        self.survival_plan = None  # type: Optional[SurvivalPlan]
+        self.heuristic_cache = HeuristicCache()
+        self.packed_scores = packed_scores  # if true, searches compare heuristics packed to integers
+        self.mcts_root = None  # type: Optional[MCTSNode]
+        self.move_generator = None  # type: Optional[MoveGenerator]
+        # game states of the minimax, paranoid and maxn searches are released to this pool after searching them
+        self.state_pool = StatePool()
+        self.clock = clock  # time limits of ticks and searches are kept by this clock, see NodeClock
+        self.time_manager = TimeManager()
+        self.deadline_overshoots = deque(maxlen=TIME_SAMPLES)  # type: deque
+        self.search_depth = 0  # depth of the last completed iteration of iterative search
+        self.telemetry = Telemetry()
+        # if telemetry_path is set, telemetry is written there by a background thread every telemetry_every ticks and
+        # when my snake dies
+        self.telemetry_path = telemetry_path
+        self.telemetry_every = telemetry_every
+        # profiling can be enabled also by the environment, e.g. when the bot is run by the game server,
+        # an empty profile_dir disables it regardless of the environment
+        if profile_dir is None:
+            profile_dir = os.environ.get('ASNAKE_PROFILE_DIR')
+        if profile_every is None:
+            profile_every = int(os.environ.get('ASNAKE_PROFILE_EVERY', PROFILE_EVERY))
+        self.profiler = TickProfiler(profile_dir, profile_every) if profile_dir else None
+        if trace_memory is None:
+            trace_memory = env_flag('ASNAKE_TRACE_MEMORY')
+        self.memory_tracer = MemoryTracer(self.telemetry) if trace_memory else None
+        # the scheduler changes the state of the collector of the whole process, so it is used only when asked for
+        if schedule_gc is None:
+            schedule_gc = env_flag('ASNAKE_SCHEDULE_GC')
+        self.gc_scheduler = GCScheduler.shared() if schedule_gc else None
+        # if record_dir is set, the game is recorded to a new file there, for replays, an empty one disables recording
+        if record_dir is None:
+            record_dir = os.environ.get('ASNAKE_RECORD_DIR')
+        self.recorder = None  # type: Optional[GameRecorder]
+        if record_dir:
+            os.makedirs(record_dir, exist_ok=True)
+            self.recorder = GameRecorder(os.path.join(record_dir, 'game-{}-{}-{}.rec'.format(
+                time.strftime('%Y%m%d-%H%M%S'), os.getpid(), next(recording_numbers))))
 
     @staticmethod
     def observe_state_changes(old_state: Optional[GameState], world, my_color: int) -> GameState:
-        """Observe what has changed since last turn and produce new game state"""
+        """Observe what has changed since last turn and produce new game state
+
+        The frame number of the new state counts also the frames we missed since the old state, as found from how far
+        the snakes moved.
+        """
         if old_state:
-            snakes_by_color = old_state.snakes_by_color
+            # copy the snakes, as the old state may still be referenced by states produced by the search
+            snakes_by_color = {color: snake.copy() for color, snake in old_state.snakes_by_color.items()}
             frame_no = old_state.frame_no + 1
         else:
             snakes_by_color = {}
@@ -293,8 +1286,10 @@ class MyRobotSnake(RobotSnake):
 
                     index += 1
 
+        missed_frames = 0
         for color, position in heads_by_color.items():
             needs_trace = False
+            old_head_pos = None  # type: Optional[XY]
             if color in new_state.snakes_by_color:
                 snake = new_state.snakes_by_color[color]
 
@@ -308,6 +1303,8 @@ class MyRobotSnake(RobotSnake):
                             snake.score += old_char
                 else:
                     needs_trace = True
+                    if snake.alive:
+                        old_head_pos = snake.head_pos
 
                 snake.head_pos = position
                 snake.tail_pos = tails_by_color[color]
@@ -330,6 +1327,14 @@ class MyRobotSnake(RobotSnake):
                 snake.head_history = deque(path[1:])
                 snake.grow = 0
                 snake.grow_uncertain = True
+                if old_head_pos is not None:
+                    # live snakes move one position each frame, the old head is as many positions back in the body
+                    if old_head_pos in path:
+                        moved = path.index(old_head_pos)
+                    else:
+                        moved = abs(position.x - old_head_pos.x) + abs(position.y - old_head_pos.y)
+                    missed_frames = max(missed_frames, moved - 1)
+        new_state.frame_no += missed_frames
 
         alive_snake_colors = set(tails_by_color.keys())
         for color, snake in new_state.snakes_by_color.items():
@@ -346,39 +1351,104 @@ class MyRobotSnake(RobotSnake):
         return new_state
 
     @staticmethod
-    def advance_game(state: GameState, snake_directions: Dict[int, XY]) -> Tuple[GameState, bool]:
+    def advance_game(state: GameState, snake_directions: Dict[int, XY],
+                     pool: Optional[StatePool] = None) -> Tuple[GameState, bool]:
         """Advance the state of game one tick, based on the selected snake directions.
 
+        Snakes that don't change are shared between the states, so game states produced by the search must not be
+        modified in place.
+
         :param state: starting game state
         :param snake_directions: a dictionary from snake color to direction of movement
+        :param pool: pool to take the new state from, see GameState.derive
         :return: a new game state based on the directions
         """
         next_snake_heads = {color: XY(state.snakes_by_color[color].head_pos.x + direction.x,
                                       state.snakes_by_color[color].head_pos.y + direction.y)
                             for color, direction in snake_directions.items()}
         tails = {snake.tail_pos: color
-                 for color, snake in state.snakes_by_color.items()}
-        new_state = GameState(state)  # copy state
-        new_state.frame_no += 1
+                 for color, snake in state.snakes_by_color.items() if snake.alive}
+        target_cells = {color: state.world_get(position) for color, position in next_snake_heads.items()}
+        return MyRobotSnake._advance_resolved(state, next_snake_heads, target_cells, tails, {}, pool)
+
+    @staticmethod
+    def expand_all(state: GameState, snake_moves: Dict[int, Sequence[XY]],
+                   pool: Optional[StatePool] = None) -> Dict[Tuple[XY, ...], Tuple[GameState, bool]]:
+        """Advance the game for all the combinations of snake moves at once.
+
+        The work that does not depend on the other snakes' moves (tail positions, growth, what is at the target
+        position of each snake's move) is done only once.
+
+        :param state: starting game state
+        :param snake_moves: a dictionary from snake color to possible directions of movement
+        :param pool: pool to take the new states from, see GameState.derive
+        :return: a dict from tuple of directions (in the order of snake_moves) to the result of advance_game
+        """
+        tails = {snake.tail_pos: color
+                 for color, snake in state.snakes_by_color.items() if snake.alive}
+        grow_decisions = {}
+        colors = list(snake_moves)
+        snake_outcomes = []  # for each snake, list of (direction, next head position, target cell)
+        for color in colors:
+            head_pos = state.snakes_by_color[color].head_pos
+            outcomes = []
+            for direction in snake_moves[color]:
+                position = XY(head_pos.x + direction.x, head_pos.y + direction.y)
+                outcomes.append((direction, position, state.world_get(position)))
+            snake_outcomes.append(outcomes)
+
+        children = {}
+        for joint_outcome in itertools.product(*snake_outcomes):
+            next_snake_heads = {}
+            target_cells = {}
+            for color, (direction, position, cell) in zip(colors, joint_outcome):
+                next_snake_heads[color] = position
+                target_cells[color] = cell
+            children[tuple(outcome[0] for outcome in joint_outcome)] = MyRobotSnake._advance_resolved(
+                state, next_snake_heads, target_cells, tails, grow_decisions, pool)
+        return children
+
+    @staticmethod
+    def _advance_resolved(state: GameState,
+                          next_snake_heads: Dict[int, XY],
+                          target_cells: Dict[int, Tuple[int, int]],
+                          tails: Dict[XY, int],
+                          grow_decisions: Dict[int, Tuple[bool, bool]],
+                          pool: Optional[StatePool] = None) -> Tuple[GameState, bool]:
+        """Advance the game given the next head positions and what is at those positions now.
+
+        :param tails: dict from tail position to color of live snakes
+        :param grow_decisions: cache of should_grow results (grows, uncertain) by color, shared between calls for
+                               the same state
+        """
         uncertainty = False  # True if we are not certain things will go this way
 
         kills = defaultdict(list)  # dict from killer to killed color
         dies = set()
         moves = set()
+        eats = {}  # dict from color to food value
 
         def should_grow(snake):
             nonlocal uncertainty
-            if len(snake.head_history) != snake.length - 1:
-                # we don't know where tail will move, leave it where it is
-                uncertainty = True
-                logger.info('uncertain because snake {} does not have full history {}/{}'.format(
-                    snake.color, len(snake.head_history), snake.length))
-                return True
-            if snake.grow_uncertain:
+            decision = grow_decisions.get(snake.color)
+            if decision is None:
+                if len(snake.head_history) != snake.length - 1:
+                    # we don't know where tail will move, leave it where it is
+                    if DEBUG_SEARCH:
+                        logger.debug('uncertain because snake %s does not have full history %d/%d',
+                                     snake.color, len(snake.head_history), snake.length)
+                    decision = True, True
+                elif snake.grow_uncertain:
+                    if DEBUG_SEARCH:
+                        logger.debug('uncertain because snake %s has grow_uncertain=True', snake.color)
+                    decision = True, True
+                else:
+                    decision = snake.grow > 0, False
+                grow_decisions[snake.color] = decision
+            grows, uncertain = decision
+            if uncertain:
                 uncertainty = True
-                logger.info('uncertain because snake {} has grow_uncertain=True'.format(snake.color))
-                return True
-            return snake.grow
+            return grows
 
         dependencies = {}  # dict from color to color
         for color, pos in next_snake_heads.items():
@@ -391,61 +1461,86 @@ class MyRobotSnake(RobotSnake):
         for color, pos in next_snake_heads.items():
             next_snake_heads_inv[pos].append(color)
 
-        # topological sort dependencies
-        # this is special cased for two-snake game, TODO add support for multiple players later
-        colors = list(next_snake_heads.keys())
-        if len(colors) == 2 and dependencies.get(colors[0]) == colors[1] and dependencies.get(colors[1]) == colors[0]:
-            # tail cycle, we need to break it explicitly
-            snake0 = state.snakes_by_color[colors[0]]
-            snake1 = state.snakes_by_color[colors[1]]
-            if should_grow(snake0) or should_grow(snake1):
-                # snake0 and snake1 both die and don't move, neither gets points
-                dies.add(colors[0])
-                dies.add(colors[1])
-            else:
-                moves.add(colors[0])
-                moves.add(colors[1])
-        else:
-            tsorted = sorted(colors, key=lambda color: 1 if color in dependencies else 0)
+        def resolve_static(color):
+            """Resolve collisions of a snake whose tail dependency (if any) is already known to be freed"""
+            old_char, old_color = target_cells[color]
+            if WORLD_DEAD_TAIL <= old_char <= WORLD_STONE:
+                # snake dies, does not move, does not get points
+                dies.add(color)
+                return
+            if WORLD_BODY <= old_char <= WORLD_HEAD:
+                # snake dies, does not move, old_color possibly gets points (if does not die in this turn)
+                dies.add(color)
+                kills[old_color].append(color)
+                return
+            if len(next_snake_heads_inv[next_snake_heads[color]]) > 1:
+                # frontal collision. snake dies, moves, does not get points
+                dies.add(color)
+                moves.add(color)
+                return
+            # did not crash into anything, so lives, moves
+            if 1 <= old_char <= 9:
+                eats[color] = old_char
+            moves.add(color)
+
+        def resolve_chase(color):
+            """Resolve a snake chasing a tail of another snake whose movement is already resolved"""
+            other_color = dependencies[color]
+            if color == other_color:
+                # self-chase, the tail moves away unless we grow
+                if should_grow(state.snakes_by_color[color]):
+                    # snake dies, does not move
+                    dies.add(color)
+                    return
+            elif should_grow(state.snakes_by_color[other_color]) or other_color not in moves:
+                # snake dies, does not move, other snake gets credit for killing us
+                kills[other_color].append(color)
+                dies.add(color)
+                return
+            resolve_static(color)
+
+        # Tail dependencies form a functional graph (each snake chases at most one tail), so we can resolve them
+        # in topological order by walking the chains, handling any cycles at their ends. Each snake is visited once.
+        unresolved, in_path, resolved = 0, 1, 2
+        resolve_state = dict.fromkeys(next_snake_heads, unresolved)
+        for start_color in next_snake_heads:
+            path = []
+            color = start_color
+            while resolve_state[color] == unresolved:
+                resolve_state[color] = in_path
+                path.append(color)
+                other_color = dependencies.get(color)
+                if other_color is None or other_color == color or other_color not in resolve_state:
+                    break
+                color = other_color
+
+            cycle_start = len(path)
+            if path and resolve_state[color] == in_path and dependencies.get(path[-1]) == color != path[-1]:
+                # tail cycle, we need to break it explicitly
+                cycle_start = path.index(color)
+                cycle = path[cycle_start:]
+                if any(should_grow(state.snakes_by_color[cycle_color]) for cycle_color in cycle):
+                    # some tail in the cycle does not move, so all the snakes die and don't move, none gets points
+                    dies.update(cycle)
+                else:
+                    for cycle_color in cycle:
+                        resolve_static(cycle_color)
 
-            for color in tsorted:
+            for color in reversed(path[:cycle_start]):
                 if color in dependencies:
-                    # tail chase
-                    other_snake = state.snakes_by_color[dependencies[color]]
-                    if color == dependencies[color]:
-                        # self-chase, pretend we can move
-                        moves.add(color)
-                    if should_grow(other_snake) or not dependencies[color] in moves:
-                        # snake dies, does not move
-                        if color == dependencies[color]:
-                            moves.remove(color)  # we pretended to move
-                        else:
-                            # other_snake gets credit for killing us
-                            kills[other_snake.color].append(color)
-                        dies.add(color)
-                        continue
-                    # fallthrough
-                old_char, old_color = state.world_get(next_snake_heads[color])
-                if WORLD_DEAD_TAIL <= old_char <= WORLD_STONE:
-                    # snake dies, does not move, does not get points
-                    dies.add(color)
-                    continue
-                if WORLD_BODY <= old_char <= WORLD_HEAD:
-                    # snake dies, does not move, old_color possibly gets points (if does not die in this turn)
-                    dies.add(color)
-                    kills[old_color].append(color)
-                    continue
-                if len(next_snake_heads_inv[next_snake_heads[color]]) > 1:
-                    # frontal collision. snake dies, moves, does not get points
-                    dies.add(color)
-                    moves.add(color)
-                    continue
-                # did not crash into anything, so lives, moves
-                if 1 <= old_char <= 9:
-                    new_snake = new_state.snakes_by_color[color]
-                    new_snake.grow += old_char
-                    new_snake.score += old_char
-                moves.add(color)
+                    resolve_chase(color)
+                else:
+                    resolve_static(color)
+            for color in path:
+                resolve_state[color] = resolved
+
+        # Copy the state, only the snakes that change
+        new_state = state.derive(moves | dies | kills.keys(), pool)
+        new_state.frame_no += 1
+        for color, food in eats.items():
+            new_snake = new_state.snakes_by_color[color]
+            new_snake.grow += food
+            new_snake.score += food
 
         # Move snakes
         needs_void = set()
@@ -485,14 +1580,14 @@ class MyRobotSnake(RobotSnake):
         return new_state, uncertainty
 
     @staticmethod
-    def bfs_food_and_partitions(state: GameState, deadline: Optional[float]):
+    def bfs_food_and_partitions(state: GameState, deadline: Optional[float], clock: Clock = WALL_CLOCK):
         """Explore world and for each head direction, find out food score and graph partition size.
 
         The food score is sum of food/distance for the positions that are closest from the head direction.
         Partition size is number of reachable nodes in the partition from that size.
 
         :param state: The game state
-        :param deadline: Optional deadline (as time.monotonic() value)
+        :param deadline: Optional deadline (as a time of the clock)
         """
         visited_positions = set()
         positions_to_visit = deque()  # contains tuples (position, distance, food_value, initial_index)
@@ -528,7 +1623,10 @@ class MyRobotSnake(RobotSnake):
             if root1 != root2:
                 partition_index[root2] = root1
 
-        while positions_to_visit and (deadline is None or time.monotonic() < deadline):
+        poll = None if deadline is None else Deadline(deadline, clock, SCAN_NODE_COST)
+        while positions_to_visit:
+            if poll is not None and poll.node_expired():
+                break
             position, distance, food_value, initial_index = positions_to_visit.popleft()
 
             if position in visited_positions:
@@ -552,6 +1650,8 @@ class MyRobotSnake(RobotSnake):
                     enqueued_positions[neighbour] = initial_index
 
             visited_positions.add(position)
+        if poll is not None:
+            poll.flush()
 
         merged_reachable_node_count = [0] * len(initial_positions)
 
@@ -565,6 +1665,176 @@ class MyRobotSnake(RobotSnake):
 
         return BFSResult(position_stats, fully_explored_distance)
 
+    @staticmethod
+    def survival_region(state: GameState) -> FrozenSet[Tuple[int, int]]:
+        """Find the region my snake lives in: positions reachable from my head through free positions or my body.
+
+        The region does not change while my snake moves around in it, only when something outside it changes.
+        """
+        my_snake = state.my_snake
+        my_body = (WORLD_TAIL | (my_snake.color << 5), WORLD_BODY | (my_snake.color << 5),
+                   WORLD_HEAD | (my_snake.color << 5))
+        size_x, size_y = state.world_size
+        world = state.world
+        start = (my_snake.head_pos.x, my_snake.head_pos.y)
+        region = {start}
+        positions_to_visit = [start]
+        while positions_to_visit:
+            position_x, position_y = positions_to_visit.pop()
+            for neighbour in ((position_x, position_y - 1), (position_x + 1, position_y),
+                              (position_x, position_y + 1), (position_x - 1, position_y)):
+                neighbour_x, neighbour_y = neighbour
+                if neighbour in region or not (0 <= neighbour_x < size_x and 0 <= neighbour_y < size_y):
+                    continue
+                encoded = world[neighbour_y * size_x + neighbour_x]
+                if (encoded & 0x1f) < WORLD_TAIL or encoded in my_body:
+                    region.add(neighbour)
+                    positions_to_visit.append(neighbour)
+        return frozenset(region)
+
+    @staticmethod
+    def snakes_separated(state: GameState, region: FrozenSet[Tuple[int, int]]) -> bool:
+        """Return True if no enemy can enter my region, i.e. the rest of the game is a single-agent problem"""
+        if state.enemy_snake is None:
+            return False  # enemy has not connected yet
+        for snake in state.snakes_by_color.values():
+            if snake is state.my_snake or not snake.alive:
+                continue
+            for neighbour in neighbours(snake.head_pos):
+                if neighbour in region:
+                    return False
+        return True
+
+    @staticmethod
+    def time_to_free(state: GameState) -> Dict[Tuple[int, int], int]:
+        """For positions occupied by snakes with known history, find after how many ticks they become free"""
+        result = {}
+        for snake in state.snakes_by_color.values():
+            if not snake.alive or snake.grow_uncertain or len(snake.head_history) != snake.length - 1:
+                continue
+            ticks = snake.grow + snake.length
+            result[(snake.head_pos.x, snake.head_pos.y)] = ticks
+            for position in snake.head_history:
+                ticks -= 1
+                result[(position.x, position.y)] = ticks
+        return result
+
+    @staticmethod
+    def plan_survival_path(state: GameState, region: FrozenSet[Tuple[int, int]],
+                           deadline: Optional[float], clock: Clock = WALL_CLOCK) -> List[Tuple[int, int]]:
+        """Construct a long path through my region, starting at (and not including) my head.
+
+        A greedy path that prefers positions with the fewest onward options (so it fills the space along walls) and
+        food on ties is built first. Positions occupied by snakes can be used once they are free at the time we get
+        there. Then the path is made longer by replacing steps with detours through adjacent free positions.
+        """
+        my_snake = state.my_snake
+        my_color = my_snake.color
+        size_x = state.world_size.x
+        world = state.world
+        time_to_free = MyRobotSnake.time_to_free(state)
+        head = (my_snake.head_pos.x, my_snake.head_pos.y)
+        path = [head]
+        on_path = {head}
+        extra_grow = 0  # our tail stays longer if we eat on the way
+
+        def usable(position, tick):
+            if position in on_path or position not in region:
+                return False
+            encoded = world[position[1] * size_x + position[0]]
+            if (encoded & 0x1f) < WORLD_TAIL:
+                return True
+            ticks = time_to_free.get(position)
+            if ticks is None:
+                return False
+            if encoded >> 5 == my_color:
+                ticks += extra_grow
+            return ticks <= tick
+
+        while deadline is None or clock.now() < deadline:
+            clock.count(SCAN_NODE_COST)
+            tick = len(path)
+            position_x, position_y = path[-1]
+            candidates = []
+            for candidate in ((position_x, position_y - 1), (position_x + 1, position_y),
+                              (position_x, position_y + 1), (position_x - 1, position_y)):
+                if not usable(candidate, tick):
+                    continue
+                candidate_x, candidate_y = candidate
+                degree = sum(1 for onward in ((candidate_x, candidate_y - 1), (candidate_x + 1, candidate_y),
+                                              (candidate_x, candidate_y + 1), (candidate_x - 1, candidate_y))
+                             if usable(onward, tick + 1))
+                food = world[candidate_y * size_x + candidate_x] & 0x1f
+                food = food if food < WORLD_TAIL else 0
+                candidates.append((degree == 0, degree, -food, candidate))
+            if not candidates:
+                break
+            _, _, negative_food, best = min(candidates)
+            extra_grow -= negative_food
+            path.append(best)
+            on_path.add(best)
+
+        # Lengthen the path: a step a->b can be replaced by a->c->d->b if c, d are free neighbours of a, b.
+        # Detours only use positions that are free right now, so the delay of later steps can't make them unusable.
+        index = 0
+        while index < len(path) - 1 and (deadline is None or clock.now() < deadline):
+            clock.count(SCAN_NODE_COST)
+            a_x, a_y = path[index]
+            b_x, b_y = path[index + 1]
+            for shift_x, shift_y in ((b_y - a_y, a_x - b_x), (a_y - b_y, b_x - a_x)):
+                c = (a_x + shift_x, a_y + shift_y)
+                d = (b_x + shift_x, b_y + shift_y)
+                if c in on_path or d in on_path or c not in region or d not in region:
+                    continue
+                if (world[c[1] * size_x + c[0]] & 0x1f) >= WORLD_TAIL or \
+                        (world[d[1] * size_x + d[0]] & 0x1f) >= WORLD_TAIL:
+                    continue
+                path[index + 1:index + 1] = [c, d]
+                on_path.add(c)
+                on_path.add(d)
+                break
+            else:
+                index += 1
+
+        return path[1:]
+
+    @staticmethod
+    def can_enter(state: GameState, position: Tuple[int, int]) -> bool:
+        """Return True if my snake can move to a neighbouring position in the next tick"""
+        char, color = state.world_get2(position)
+        if char < WORLD_TAIL:
+            return True
+        my_snake = state.my_snake
+        return char == WORLD_TAIL and color == my_snake.color and not my_snake.grow_uncertain and my_snake.grow == 0
+
+    def survival_move(self, state: GameState, deadline: Optional[float]) -> Optional[XY]:
+        """If my snake is alone in its region, return the next move of the (cached) space-filling plan.
+
+        :return: the move or None if the snakes are not separated and the regular search should be used
+        """
+        if not state.my_snake.alive:
+            return None
+        region = self.survival_region(state)
+        if not self.snakes_separated(state, region):
+            self.survival_plan = None
+            return None
+
+        head = (state.my_snake.head_pos.x, state.my_snake.head_pos.y)
+        plan = self.survival_plan
+        if plan is not None and plan.region == region and len(plan.path) > 1 and plan.path[0] == head and \
+                self.can_enter(state, plan.path[1]):
+            plan.path.popleft()
+        else:
+            logger.info('Planning survival path')
+            plan = self.survival_plan = SurvivalPlan(region, deque(self.plan_survival_path(state, region, deadline,
+                                                                                             self.clock)))
+            logger.info('Survival path has length %d', len(plan.path))
+            if not plan.path:
+                self.survival_plan = None
+                return None
+        next_x, next_y = plan.path[0]
+        return XY(next_x - head[0], next_y - head[1])
+
     @staticmethod
     def heuristic(state: GameState, bfs: BFSResult, bfs_branch: Optional[BFSPosition], depth: int):
         """Larger return values are better for my_snake"""
@@ -573,9 +1843,21 @@ class MyRobotSnake(RobotSnake):
 
         me_lives = state.my_snake is not None and state.my_snake.alive
         my_length = state.my_snake.length if state.my_snake is not None else 0
-        enemy_lives = state.enemy_snake is not None and state.enemy_snake.alive
         my_score = 0 if state.my_snake is None else state.my_snake.score
-        enemy_score = 0 if state.enemy_snake is None else state.enemy_snake.score
+        if state.enemy_snake is None:
+            enemy_lives = False
+            enemy_score = 0
+        elif len(state.snakes_by_color) > 2:
+            # in multiplayer games, compare against the strongest of the enemies
+            enemy_lives = False
+            enemy_score = 0
+            for snake in state.snakes_by_color.values():
+                if snake is not state.my_snake:
+                    enemy_lives = enemy_lives or snake.alive
+                    enemy_score = max(enemy_score, snake.score)
+        else:
+            enemy_lives = state.enemy_snake.alive
+            enemy_score = state.enemy_snake.score
 
         # The game is limited to 8192 frames
         if state.frame_no > 8192:
@@ -617,114 +1899,540 @@ class MyRobotSnake(RobotSnake):
         return Heuristic(game_result, liveness, entering_small_partition, score, bfs_branch.food_score,
                          bfs_branch.partition_size, depth if game_result < 0 or liveness < 0 else -depth)
 
+    @staticmethod
+    def heuristic_key(state: GameState, bfs: BFSResult, bfs_branch: Optional[BFSPosition], depth: int) -> Tuple:
+        """Return a hashable value that is equal for the arguments heuristic() returns the same value for
+
+        Only what the heuristic reads is included (not the world), so positions reached by different move orders
+        share the key.
+        """
+        my_snake = state.my_snake
+        return (None if my_snake is None else my_snake.color,
+                None if my_snake is None else my_snake.length,
+                None if state.enemy_snake is None else state.enemy_snake.color,
+                tuple((snake.alive, snake.score) for snake in state.snakes_by_color.values()),
+                state.frame_no > 8192, bfs.fully_explored_distance >= depth,
+                None if bfs_branch is None else (bfs_branch.partition_size, bfs_branch.food_score), depth)
+
+    def evaluate(self, state: GameState, bfs: BFSResult, bfs_branch: Optional[BFSPosition], depth: int):
+        """Return the heuristic value for the state, reusing values computed for equal arguments"""
+        key = self.heuristic_key(state, bfs, bfs_branch, depth)
+        value = self.heuristic_cache.get(key)
+        if value is None:
+            value = self.heuristic(state, bfs, bfs_branch, depth)
+            if self.packed_scores:
+                value = pack_heuristic(value)
+            self.heuristic_cache.put(key, value)
+        return value
+
     def iterative_search_move_space(self,
                                     game_state: GameState,
                                     deadline: Optional[float],
                                     bfs: BFSResult) -> Tuple[Any, Optional[XY], int]:
+        search = {
+            SEARCH_MINIMAX: self.search_move_space,
+            SEARCH_PARANOID: self.search_move_space_paranoid,
+            SEARCH_MAXN: self.search_move_space_maxn,
+        }[self.search_mode]
         best_move = None
         best_score = None
         total_explored_states = 0
+        iteration_times = []  # type: List[float]
+        iteration_states = []  # type: List[int]
+        poll = None if deadline is None else Deadline(deadline, self.clock)
+        self.search_depth = 0
         depth = 1
         while True:
+            start_time = self.clock.now()
+            if deadline is not None:
+                predicted_time = self.predict_iteration_time(iteration_times, iteration_states)
+                if predicted_time is not None and start_time + predicted_time > deadline:
+                    logger.info('Not starting depth %d, predicted %.3f ms with %.3f ms left',
+                                depth, predicted_time * 1000, (deadline - start_time) * 1000)
+                    return best_score, best_move, total_explored_states
             try:
-                score, move, explored_states, explored_all = self.search_move_space(0, depth, game_state, deadline,
-                                                                                    None, bfs)
-            except SearchTimedOut:
-                logger.info('Search timed out in depth {}'.format(depth))
+                # the best move of the previous depth is searched first, so that a partial result includes it
+                score, move, explored_states, explored_all = search(0, depth, game_state, poll, None, bfs,
+                                                                    first_move=best_move)
+            except SearchTimedOut as e:
+                logger.info('Search timed out in depth %d', depth)
+                if poll is not None and poll.overshoot is not None:
+                    self.deadline_overshoots.append(poll.overshoot)
+                    self.telemetry.record('overshoot_ms', poll.overshoot * 1000)
+                total_explored_states += e.explored_states
+                if e.best_move is not None:
+                    logger.info('Using partial result of depth %d: %r instead of %r', depth, e.best_move, best_move)
+                    return e.best_score, e.best_move, total_explored_states
                 return best_score, best_move, total_explored_states
             else:
+                if poll is not None:
+                    poll.flush()
+                iteration_times.append(self.clock.now() - start_time)
+                iteration_states.append(explored_states)
                 total_explored_states += explored_states
                 best_move = move
                 best_score = score
+                self.search_depth = depth
                 depth += 1
                 if explored_all:
                     return best_score, best_move, total_explored_states
 
+    @staticmethod
+    def predict_iteration_time(iteration_times: List[float], iteration_states: List[int]) -> Optional[float]:
+        """Predict the time of the next deepening iteration from the previous ones, None if there's not enough data
+
+        The time of the last iteration is scaled by the effective branching factor, the ratio of states explored
+        by the last two iterations.
+        """
+        if len(iteration_times) < 2 or iteration_states[-2] == 0:
+            return None
+        branching_factor = iteration_states[-1] / iteration_states[-2]
+        return iteration_times[-1] * max(1.0, branching_factor)
+
     def search_move_space(self,
                           depth: int,
                           max_depth: int,
                           game_state: GameState,
-                          deadline: Optional[float],
+                          deadline: Optional[Deadline],
                           bfs_branch: Optional[BFSPosition],
-                          bfs: BFSResult) -> Tuple[Any, Optional[XY], int, bool]:
-        moves = [DIR_UP, DIR_RIGHT, DIR_DOWN, DIR_LEFT]
+                          bfs: BFSResult,
+                          first_move: Optional[XY] = None) -> Tuple[Any, Optional[XY], int, bool]:
         if depth == max_depth or not game_state.my_snake.alive:
-            return self.heuristic(game_state, bfs, bfs_branch, depth), None, 0, True
+            # the search is cut by depth only if we are still alive
+            return self.evaluate(game_state, bfs, bfs_branch, depth), None, 0, not game_state.my_snake.alive
+        if depth == 0:
+            self.prepare_move_generator(game_state)
+
+        enemy_snake = game_state.enemy_snake
+        enemy_moves = None
+        if enemy_snake is not None and enemy_snake.alive:
+            if self.heads_apart(game_state.my_snake, enemy_snake, max_depth - depth):
+                # the enemy can't interact with us within the search horizon, so it's enough to search our moves
+                # and let the enemy follow a cheap default policy
+                enemy_moves = [self.default_move(game_state, enemy_snake)]
+            else:
+                enemy_moves = self.move_generator.moves(enemy_snake)
+
+        my_moves = self.move_generator.moves(game_state.my_snake)
+        if enemy_moves is not None:
+            children = self.expand_all(game_state, {game_state.my_snake.color: my_moves,
+                                                    enemy_snake.color: enemy_moves}, self.state_pool)
+        else:
+            children = self.expand_all(game_state, {game_state.my_snake.color: my_moves}, self.state_pool)
 
         best_move = None
         best_score = None
         explored_states = 0
         explored_all = True
-        for my_move in moves:
-            my_direction = game_state.my_snake.direction
-            if my_direction is not None and my_move.x == -my_direction.x and my_move.y == -my_direction.y:
-                continue  # can't move backwards
-
-            if bfs_branch is not None:
-                move_bfs_branch = bfs_branch
-            else:
-                next_head_pos = XY(game_state.my_snake.head_pos.x + my_move.x,
-                                   game_state.my_snake.head_pos.y + my_move.y)
-                for branch in bfs.position_stats:
-                    if branch.position == (next_head_pos.x, next_head_pos.y):
-                        move_bfs_branch = branch
-                        break
+        try:
+            for my_move in self.order_moves(my_moves, first_move):
+                if bfs_branch is not None:
+                    move_bfs_branch = bfs_branch
+                else:
+                    next_head_pos = XY(game_state.my_snake.head_pos.x + my_move.x,
+                                       game_state.my_snake.head_pos.y + my_move.y)
+                    for branch in bfs.position_stats:
+                        if branch.position == (next_head_pos.x, next_head_pos.y):
+                            move_bfs_branch = branch
+                            break
+                    else:
+                        move_bfs_branch = BFSPosition((next_head_pos.x, next_head_pos.y), 0, 0.0)
+
+                if enemy_moves is not None:
+                    worst_enemy_move = None
+                    worst_enemy_score = None
+                    for enemy_move in enemy_moves:
+                        if deadline is not None:
+                            deadline.check_node()
+                        explored_states += 1
+                        new_state, uncertainty = children[my_move, enemy_move]
+                        if uncertainty:
+                            score = self.evaluate(new_state, bfs, move_bfs_branch, depth)
+                        else:
+                            score, _, explored_substates, sub_explored_all = self.search_move_space(
+                                depth + 1, max_depth, new_state, deadline, move_bfs_branch, bfs)
+                            explored_states += explored_substates
+                            if not sub_explored_all:
+                                explored_all = False
+                        self.state_pool.release(new_state)
+
+                        if worst_enemy_move is None or score < worst_enemy_score:
+                            worst_enemy_move = enemy_move
+                            worst_enemy_score = score
+
+                    if best_move is None or worst_enemy_score > best_score:
+                        best_move = my_move
+                        best_score = worst_enemy_score
                 else:
-                    move_bfs_branch = BFSPosition((next_head_pos.x, next_head_pos.y), 0, 0.0)
-
-            if game_state.enemy_snake and game_state.enemy_snake.alive:
-                enemy_direction = game_state.enemy_snake.direction
-                worst_enemy_move = None
-                worst_enemy_score = None
-                for enemy_move in moves:
-                    if enemy_direction is not None and enemy_move.x == -enemy_direction.x and \
-                            enemy_move.y == -enemy_direction.y:
-                        continue  # can't move backwards
-                    if deadline is not None and time.monotonic() > deadline:
-                        raise SearchTimedOut()
-                    snake_directions = {
-                        game_state.my_snake.color: my_move,
-                        game_state.enemy_snake.color: enemy_move,
-                    }
+                    if deadline is not None:
+                        deadline.check_node()
                     explored_states += 1
-                    new_state, uncertainty = self.advance_game(game_state, snake_directions)
+                    new_state, uncertainty = children[my_move,]
                     if uncertainty:
-                        score = self.heuristic(new_state, bfs, move_bfs_branch, depth)
+                        score = self.evaluate(new_state, bfs, move_bfs_branch, depth)
                     else:
                         score, _, explored_substates, sub_explored_all = self.search_move_space(
                             depth + 1, max_depth, new_state, deadline, move_bfs_branch, bfs)
                         explored_states += explored_substates
                         if not sub_explored_all:
                             explored_all = False
+                    self.state_pool.release(new_state)
+                    if best_move is None or score > best_score:
+                        best_move = my_move
+                        best_score = score
+        except SearchTimedOut as e:
+            if depth == 0:
+                raise SearchTimedOut(best_score, best_move, explored_states + e.explored_states)
+            raise
+        return best_score, best_move, explored_states, explored_all
+
+    @staticmethod
+    def order_moves(moves: Sequence[XY], first_move: Optional[XY]) -> Sequence[XY]:
+        """Return the moves with first_move (if it is one of them) moved to the front"""
+        if first_move is None or first_move not in moves:
+            return moves
+        return [first_move] + [move for move in moves if move != first_move]
 
-                    if worst_enemy_move is None or score < worst_enemy_score:
-                        worst_enemy_move = enemy_move
-                        worst_enemy_score = score
+    def prepare_move_generator(self, game_state: GameState):
+        """Make sure the move generator is made for the root of the current search"""
+        if self.move_generator is None or self.move_generator.state is not game_state:
+            self.move_generator = MoveGenerator(game_state)
 
-                if best_move is None or worst_enemy_score > best_score:
+    @staticmethod
+    def possible_moves(snake: Snake) -> List[XY]:
+        """Return the directions the snake can move to (i.e. all except backwards)"""
+        direction = snake.direction
+        if direction is None:
+            return [DIR_UP, DIR_RIGHT, DIR_DOWN, DIR_LEFT]
+        return [move for move in (DIR_UP, DIR_RIGHT, DIR_DOWN, DIR_LEFT)
+                if move.x != -direction.x or move.y != -direction.y]
+
+    @staticmethod
+    def select_bfs_branch(game_state: GameState, my_move: XY, bfs_branch: Optional[BFSPosition],
+                          bfs: BFSResult) -> BFSPosition:
+        """Find the BFS statistics for the root move (subtrees inherit the branch of their root move)"""
+        if bfs_branch is not None:
+            return bfs_branch
+        next_head_pos = (game_state.my_snake.head_pos.x + my_move.x, game_state.my_snake.head_pos.y + my_move.y)
+        for branch in bfs.position_stats:
+            if branch.position == next_head_pos:
+                return branch
+        return BFSPosition(next_head_pos, 0, 0.0)
+
+    @staticmethod
+    def heads_apart(snake1: Snake, snake2: Snake, remaining_depth: int) -> bool:
+        """Return True if the snakes can't reach each other's heads within the remaining search depth.
+
+        Both heads move one cell per tick, so this is the case when the manhattan distance of the heads is larger than
+        twice the remaining depth.
+        """
+        distance = abs(snake1.head_pos.x - snake2.head_pos.x) + abs(snake1.head_pos.y - snake2.head_pos.y)
+        return distance > 2 * remaining_depth
+
+    @staticmethod
+    def default_move(state: GameState, snake: Snake) -> XY:
+        """Cheap policy for snakes we don't search for: go straight if possible, otherwise turn to a free position"""
+        moves = MyRobotSnake.possible_moves(snake)
+        direction = snake.direction
+        if direction is not None:
+            moves.remove(direction)
+            moves.insert(0, direction)
+        for move in moves:
+            char, color = state.world_get2((snake.head_pos.x + move.x, snake.head_pos.y + move.y))
+            if char < WORLD_TAIL:  # not occupied
+                return move
+        return moves[0]
+
+    @staticmethod
+    def relevant_enemies(game_state: GameState, remaining_depth: int) -> List[Snake]:
+        """Return live enemy snakes whose heads can get near my head within the remaining search depth.
+
+        Both heads move one cell per tick, so snakes farther apart than twice the remaining depth can't collide
+        within the search horizon. Other snakes are left standing in the simulated future to bound the branching.
+        """
+        return [snake for snake in game_state.snakes_by_color.values()
+                if snake.alive and snake is not game_state.my_snake and
+                not MyRobotSnake.heads_apart(game_state.my_snake, snake, remaining_depth)]
+
+    def search_move_space_paranoid(self,
+                                   depth: int,
+                                   max_depth: int,
+                                   game_state: GameState,
+                                   deadline: Optional[Deadline],
+                                   bfs_branch: Optional[BFSPosition],
+                                   bfs: BFSResult,
+                                   alpha: Any = None,
+                                   beta: Any = None,
+                                   first_move: Optional[XY] = None) -> Tuple[Any, Optional[XY], int, bool]:
+        """Search assuming all the enemies in reach cooperate against me, using alpha-beta pruning.
+
+        The enemies move simultaneously, so each of my moves is answered by the worst joint move of all relevant
+        enemies. alpha and beta are the bounds of the window (None means unbounded).
+        """
+        if depth == max_depth or not game_state.my_snake.alive:
+            return self.evaluate(game_state, bfs, bfs_branch, depth), None, 0, not game_state.my_snake.alive
+
+        if depth == 0:
+            self.prepare_move_generator(game_state)
+        enemies = self.relevant_enemies(game_state, max_depth - depth)
+        enemy_moves = list(itertools.product(*(self.move_generator.moves(enemy) for enemy in enemies)))
+
+        best_move = None
+        best_score = None
+        explored_states = 0
+        explored_all = True
+        try:
+            for my_move in self.order_moves(self.move_generator.moves(game_state.my_snake), first_move):
+                move_bfs_branch = self.select_bfs_branch(game_state, my_move, bfs_branch, bfs)
+                worst_score = None
+                for joint_move in enemy_moves:
+                    if deadline is not None:
+                        deadline.check_node()
+                    snake_directions = {enemy.color: enemy_move for enemy, enemy_move in zip(enemies, joint_move)}
+                    snake_directions[game_state.my_snake.color] = my_move
+                    explored_states += 1
+                    new_state, uncertainty = self.advance_game(game_state, snake_directions, self.state_pool)
+                    if uncertainty:
+                        score = self.evaluate(new_state, bfs, move_bfs_branch, depth)
+                    else:
+                        child_beta = worst_score if beta is None or (worst_score is not None and worst_score < beta) \
+                            else beta
+                        score, _, explored_substates, sub_explored_all = self.search_move_space_paranoid(
+                            depth + 1, max_depth, new_state, deadline, move_bfs_branch, bfs, alpha, child_beta)
+                        explored_states += explored_substates
+                        if not sub_explored_all:
+                            explored_all = False
+                    self.state_pool.release(new_state)
+
+                    if worst_score is None or score < worst_score:
+                        worst_score = score
+                    if alpha is not None and worst_score <= alpha:
+                        break  # I already have a better move elsewhere, enemies won't let me get more here
+
+                if best_move is None or worst_score > best_score:
                     best_move = my_move
-                    best_score = worst_enemy_score
-            else:
-                if deadline is not None and time.monotonic() > deadline:
-                    raise SearchTimedOut()
-                snake_directions = {
-                    game_state.my_snake.color: my_move,
-                }
+                    best_score = worst_score
+                    if alpha is None or best_score > alpha:
+                        alpha = best_score
+                if beta is not None and best_score >= beta:
+                    break  # enemies already have a better option elsewhere
+        except SearchTimedOut as e:
+            if depth == 0:
+                raise SearchTimedOut(best_score, best_move, explored_states + e.explored_states)
+            raise
+
+        return best_score, best_move, explored_states, explored_all
+
+    @staticmethod
+    def enemy_heuristic(state: GameState, color: int):
+        """Larger return values are better for the snake of given color"""
+        snake = state.snakes_by_color[color]
+        best_other_score = max((other.score for other in state.snakes_by_color.values() if other is not snake),
+                               default=0)
+        return snake.alive, snake.score - best_other_score, snake.length
+
+    def search_move_space_maxn(self,
+                               depth: int,
+                               max_depth: int,
+                               game_state: GameState,
+                               deadline: Optional[Deadline],
+                               bfs_branch: Optional[BFSPosition],
+                               bfs: BFSResult,
+                               first_move: Optional[XY] = None) -> Tuple[Any, Optional[XY], int, bool]:
+        """Search where each snake in reach maximizes its own heuristic.
+
+        Simultaneous moves are serialized: I choose first and each enemy chooses knowing the moves chosen before it.
+        The score is a dict from color to that snake's heuristic; my entry is the result of self.heuristic.
+        """
+        my_color = game_state.my_snake.color
+        if depth == max_depth or not game_state.my_snake.alive:
+            scores = {color: self.enemy_heuristic(game_state, color) for color in game_state.snakes_by_color}
+            scores[my_color] = self.evaluate(game_state, bfs, bfs_branch, depth)
+            return scores, None, 0, not game_state.my_snake.alive
+
+        if depth == 0:
+            self.prepare_move_generator(game_state)
+        players = [game_state.my_snake] + self.relevant_enemies(game_state, max_depth - depth)
+        explored_states = 0
+        explored_all = True
+
+        def choose(player_index: int, snake_directions: Dict[int, XY], move_bfs_branch: Optional[BFSPosition]):
+            nonlocal explored_states, explored_all
+            if player_index == len(players):
+                if deadline is not None:
+                    deadline.check_node()
                 explored_states += 1
-                new_state, uncertainty = self.advance_game(game_state, snake_directions)
+                new_state, uncertainty = self.advance_game(game_state, snake_directions, self.state_pool)
                 if uncertainty:
-                    score = self.heuristic(new_state, bfs, move_bfs_branch, depth)
+                    scores = {color: self.enemy_heuristic(new_state, color) for color in new_state.snakes_by_color}
+                    scores[my_color] = self.evaluate(new_state, bfs, move_bfs_branch, depth)
                 else:
-                    score, _, explored_substates, sub_explored_all = self.search_move_space(
+                    scores, _, explored_substates, sub_explored_all = self.search_move_space_maxn(
                         depth + 1, max_depth, new_state, deadline, move_bfs_branch, bfs)
                     explored_states += explored_substates
                     if not sub_explored_all:
                         explored_all = False
-                if best_move is None or score > best_score:
-                    best_move = my_move
-                    best_score = score
+                self.state_pool.release(new_state)
+                return scores, None
+
+            player = players[player_index]
+            best_scores = None
+            best_move = None
+            moves = self.move_generator.moves(player)
+            if player_index == 0:
+                moves = self.order_moves(moves, first_move)
+            for move in moves:
+                if player_index == 0:
+                    move_bfs_branch = self.select_bfs_branch(game_state, move, bfs_branch, bfs)
+                snake_directions[player.color] = move
+                scores, _ = choose(player_index + 1, snake_directions, move_bfs_branch)
+                if best_move is None or scores[player.color] > best_scores[player.color]:
+                    best_move = move
+                    best_scores = scores
+                    if player_index == 0:
+                        my_best[:] = best_scores, best_move
+            del snake_directions[player.color]
+            return best_scores, best_move
+
+        my_best = [None, None]  # best scores and move of my completely searched moves
+        try:
+            best_scores, best_move = choose(0, {}, bfs_branch)
+        except SearchTimedOut as e:
+            if depth == 0:
+                raise SearchTimedOut(my_best[0], my_best[1], explored_states + e.explored_states)
+            raise
+        return best_scores, best_move, explored_states, explored_all
 
-        return best_score, best_move, explored_states, explored_all
+    @staticmethod
+    def mcts_value(heuristic: Heuristic) -> float:
+        """Map the heuristic to a playout result in range [0, 1], larger values are better for my_snake"""
+        if heuristic.game_result != 0:
+            return 1.0 if heuristic.game_result > 0 else 0.0
+        score = heuristic.score
+        value = 0.5 + 0.3 * heuristic.liveness + 0.1 * heuristic.entering_small_partition + \
+            0.1 * score / (abs(score) + 10) + 0.05 * heuristic.food_score / (heuristic.food_score + 1)
+        return min(max(value, 0.0), 1.0)
+
+    def mcts_new_node(self, state: GameState, uncertainty: bool) -> MCTSNode:
+        terminal = uncertainty or not state.my_snake.alive
+        snakes = [] if terminal else [state.my_snake] + self.relevant_enemies(state, MCTS_REACH)
+        return MCTSNode(state, terminal, snakes, [self.move_generator.moves(snake) for snake in snakes])
+
+    def mcts_playout(self, state: GameState, bfs: BFSResult, bfs_branch: BFSPosition, depth: int) -> Tuple[float, int]:
+        """Simulate a few ticks with random non-suicidal moves and evaluate the final state by heuristic.
+
+        :return: tuple of value for my snake and number of simulated states
+        """
+        simulated_states = 0
+        for playout_depth in range(MCTS_PLAYOUT_DEPTH):
+            if not state.my_snake.alive:
+                break
+            snake_directions = {}
+            for snake in [state.my_snake] + self.relevant_enemies(state, MCTS_PLAYOUT_DEPTH):
+                moves = []
+                for move in self.possible_moves(snake):
+                    char, color = state.world_get2((snake.head_pos.x + move.x, snake.head_pos.y + move.y))
+                    if char < WORLD_TAIL:
+                        moves.append(move)
+                snake_directions[snake.color] = random.choice(moves) if moves else snake.direction or DIR_UP
+            state, uncertainty = self.advance_game(state, snake_directions)
+            simulated_states += 1
+            depth += 1
+            if uncertainty:
+                break
+        return self.mcts_value(self.heuristic(state, bfs, bfs_branch, depth)), simulated_states
+
+    def mcts_reuse_root(self, game_state: GameState) -> Optional[MCTSNode]:
+        """Find the subtree of the previous tick's root that corresponds to the observed game state"""
+        old_root = self.mcts_root
+        if old_root is None or old_root.terminal or old_root.state.frame_no + 1 != game_state.frame_no:
+            return None
+        joint_move = []
+        for color, moves in zip(old_root.colors, old_root.moves):
+            old_head = old_root.state.snakes_by_color[color].head_pos
+            new_snake = game_state.snakes_by_color.get(color)
+            if new_snake is None:
+                return None
+            move = XY(new_snake.head_pos.x - old_head.x, new_snake.head_pos.y - old_head.y)
+            if move not in moves:
+                return None
+            joint_move.append(moves.index(move))
+        child = old_root.children.get(tuple(joint_move))
+        if child is None or child.terminal or child.state.world != game_state.world:
+            return None
+        child.state = game_state  # observed state has more accurate information about the snakes
+        # the states of the subtree are derived from the predicted state, which has the same world as the observed one;
+        # deriving them from the observed state instead lets the states of the previous ticks be freed
+        for grandchild in child.children.values():
+            grandchild.state.parent = game_state
+        return child
+
+    def mcts_search_move_space(self,
+                               game_state: GameState,
+                               deadline: Optional[float],
+                               bfs: BFSResult,
+                               max_iterations: Optional[int] = None) -> Tuple[Any, Optional[XY], int]:
+        """Anytime Monte Carlo tree search using decoupled UCT for the simultaneous moves.
+
+        The search tree is kept between ticks, so the subtree that matches the observed game state is reused.
+
+        :return: tuple of (mean playout value of the best move, best move, number of simulated states)
+        """
+        self.prepare_move_generator(game_state)
+        root = self.mcts_reuse_root(game_state)
+        if root is None:
+            root = self.mcts_new_node(game_state, False)
+        else:
+            logger.info('Reusing search tree with %d visits', root.visits)
+        self.mcts_root = root
+        if root.terminal:
+            return None, None, 0
+
+        explored_states = 0
+        iterations = 0
+        counted_states = 0
+        while (deadline is None or self.clock.now() < deadline) and \
+                (max_iterations is None or iterations < max_iterations):
+            iterations += 1
+            node = root
+            path = []
+            depth = 0
+            bfs_branch = None
+            while True:
+                joint_move = node.select(MCTS_EXPLORATION)
+                path.append((node, joint_move))
+                if bfs_branch is None:
+                    bfs_branch = self.select_bfs_branch(node.state, node.moves[0][joint_move[0]], None, bfs)
+                depth += 1
+                child = node.children.get(joint_move)
+                if child is None:
+                    snake_directions = {color: moves[move_index]
+                                        for color, moves, move_index in zip(node.colors, node.moves, joint_move)}
+                    new_state, uncertainty = self.advance_game(node.state, snake_directions)
+                    explored_states += 1
+                    child = node.children[joint_move] = self.mcts_new_node(new_state, uncertainty)
+                    if child.terminal:
+                        value = self.mcts_value(self.heuristic(new_state, bfs, bfs_branch, depth))
+                    else:
+                        value, simulated_states = self.mcts_playout(new_state, bfs, bfs_branch, depth)
+                        explored_states += simulated_states
+                    break
+                if child.terminal:
+                    value = self.mcts_value(self.heuristic(child.state, bfs, bfs_branch, depth))
+                    break
+                node = child
+
+            for node, joint_move in path:
+                node.update(joint_move, value)
+            # every iteration costs at least one node, so that the virtual time passes also in a terminal tree
+            self.clock.count(max(1, explored_states - counted_states))
+            counted_states = explored_states
+
+        if root.visits == 0:
+            return None, None, explored_states
+        best_index = max(range(len(root.moves[0])), key=lambda index: root.move_visits[0][index])
+        best_value = root.move_totals[0][best_index] / max(root.move_visits[0][best_index], 1)
+        return best_value, root.moves[0][best_index], explored_states
 
     def next_direction(self, initial=False):
         """
@@ -741,48 +2449,111 @@ class MyRobotSnake(RobotSnake):
 
         More information can be found in the Snake documentation.
         """
-        tick_start_time = time.monotonic()
-        self.frame_no += 1
-        logger.info('------------- tick start {}'.format(self.frame_no))
-        # the frame rate is 9 at the beginning and goes up to 60 later
-        # so we can run deeper searches in the first 1024 frames (we use 1000 to have some buffer)
-        # the deadline is 3/4 the frame time, to allow for replies, etc.
-
-        if self.frame_no < 1024:
-            tick_time_limit = 0.75 * (1 / 9.0)
+        # the time limit is kept by self.clock, the durations in the log and telemetry are measured in wall time
+        tick_start_time = self.clock.now()
+        tick_start_wall_time = time.monotonic()
+        if self.gc_scheduler is not None:
+            # waits for the collection after the previous tick, if it has not finished yet
+            self.gc_scheduler.start_tick()
+        # the collector and the switch interval are global, so they are restored even if the tick fails
+        try:
+            self.frame_no += 1
+            if self.profiler is not None:
+                self.profiler.start(self.frame_no)
+            try:
+                best_move = self.tick(tick_start_time, tick_start_wall_time)
+            finally:
+                if self.profiler is not None:
+                    time_limit = self.time_manager.time_limit
+                    self.profiler.stop(self.frame_no,
+                                       time_limit is None or self.clock.now() - tick_start_time > time_limit)
+        finally:
+            if self.gc_scheduler is not None:
+                self.gc_scheduler.end_tick()
+        # convert relative move to one of the documented return values
+        # we could have converted to snakepit.datatypes.Vector directly, but it is not documented that it will be
+        # accessible, so it's better to be safe than sorry
+        if best_move == DIR_UP:
+            return self.UP
+        elif best_move == DIR_RIGHT:
+            return self.RIGHT
+        elif best_move == DIR_DOWN:
+            return self.DOWN
+        elif best_move == DIR_LEFT:
+            return self.LEFT
         else:
-            tick_time_limit = 0.75 * (1 / 60.0)
-        tick_deadline = tick_start_time + tick_time_limit
-        logger.info('time limit: {}ms'.format(tick_time_limit*1000))
+            logger.error('Invalid value of best_move, falling back to the same direction')
+            return None
 
-        if self.old_state:
-            for snake in self.old_state.snakes_by_color.values():
-                logger.info('old {!r} {!r} {} {}'.format(snake, snake.score, 'alive' if snake.alive else 'dead',
-                                                         snake.head_history))
+    def tick(self, tick_start_time: float, tick_start_wall_time: float) -> Optional[XY]:
+        """Observe the world of the current frame and choose the next move"""
+        logger.info('------------- tick start %d', self.frame_no)
+        if self.memory_tracer is not None:
+            self.memory_tracer.begin()
         start_time = time.monotonic()
         game_state = self.observe_state_changes(self.old_state, self.world, self.color)
         end_time = time.monotonic()
-        logger.info('Observe took {} milliseconds'.format((end_time - start_time) * 1000))
+        if self.memory_tracer is not None:
+            self.memory_tracer.end('observe')
+        logger.info('Observe took %.3f ms', (end_time - start_time) * 1000)
+        self.telemetry.record('observe_ms', (end_time - start_time) * 1000)
         for snake in game_state.snakes_by_color.values():
-            logger.info('{!r} {!r} {} {}'.format(snake, snake.score, 'alive' if snake.alive else 'dead',
-                                                 snake.head_history))
+            logger.info('%r score %d %s, history %d/%d, grow %d%s', snake, snake.score,
+                        'alive' if snake.alive else 'dead', len(snake.head_history), snake.length - 1, snake.grow,
+                        ' (uncertain)' if snake.grow_uncertain else '')
+            logger.debug('%r history %r', snake, snake.head_history)
 
-        logger.info('Selecting next move')
+        # the time limit is set from the frames since the last tick, which are known once the world is observed
+        tick_time_limit = self.time_manager.start_tick(tick_start_time, game_state.frame_no, tick_start_wall_time)
+        tick_deadline = tick_start_time + tick_time_limit
+        logger.info('Frame %d, time limit: %.3f ms', game_state.frame_no, tick_time_limit * 1000)
 
-        logger.info('Running BFS')
+        if self.memory_tracer is not None:
+            self.memory_tracer.begin()
         start_time = time.monotonic()
-        bfs = self.bfs_food_and_partitions(game_state, start_time + tick_time_limit / 4)
+        bfs = self.bfs_food_and_partitions(game_state, self.clock.now() + tick_time_limit / 4, self.clock)
         end_time = time.monotonic()
-        logger.info('BFS took {} ms, explored to distance {}'.format((end_time - start_time) * 1000,
-                                                                     bfs.fully_explored_distance))
-
+        if self.memory_tracer is not None:
+            self.memory_tracer.end('bfs')
+        logger.info('BFS took %.3f ms, explored to distance %d', (end_time - start_time) * 1000,
+                    bfs.fully_explored_distance)
+        self.telemetry.record('bfs_ms', (end_time - start_time) * 1000)
+        self.telemetry.record('bfs_distance', bfs.fully_explored_distance)
+
+        if self.memory_tracer is not None:
+            self.memory_tracer.begin()
         start_time = time.monotonic()
-        best_score, best_move, explored_states = self.iterative_search_move_space(game_state,
-                                                                                  tick_deadline,
-                                                                                  bfs)
-        end_time = time.monotonic()
-        logger.info('Iterative search took {} ms, explored {} states'.format((end_time - start_time) * 1000,
-                                                                             explored_states))
+        best_score = None
+        explored_states = 0
+        search_ms = 0.0
+        search_depth = 0
+        best_move = self.survival_move(game_state, tick_deadline)
+        if best_move is not None:
+            end_time = time.monotonic()
+            logger.info('Snakes are separated, survival move took %.3f ms', (end_time - start_time) * 1000)
+        else:
+            if self.search_mode == SEARCH_MCTS:
+                best_score, best_move, explored_states = self.mcts_search_move_space(game_state, tick_deadline, bfs)
+            else:
+                best_score, best_move, explored_states = self.iterative_search_move_space(game_state,
+                                                                                          tick_deadline,
+                                                                                          bfs)
+            end_time = time.monotonic()
+            search_ms = (end_time - start_time) * 1000
+            logger.info('Iterative search took %.3f ms, explored %d states', search_ms, explored_states)
+            self.telemetry.record('search_ms', search_ms)
+            self.telemetry.record('search_states', explored_states)
+            if self.search_mode != SEARCH_MCTS:
+                search_depth = self.search_depth
+                self.telemetry.record('search_depth', search_depth)
+        if self.memory_tracer is not None:
+            self.memory_tracer.end('search')
+        if self.deadline_overshoots and logger.isEnabledFor(logging.INFO):
+            overshoots = sorted(self.deadline_overshoots)
+            logger.info('Deadline overshoot median %.3f ms, max %.3f ms in last %d timeouts',
+                        overshoots[len(overshoots) // 2] * 1000, overshoots[-1] * 1000, len(overshoots))
+        logger.info('Heuristic cache %d hits, %d misses', self.heuristic_cache.hits, self.heuristic_cache.misses)
+        self.heuristic_cache.reset_stats()
 
         if best_move is None:
             # Something bad has happened as we could not search depth 1. At least try to use some simple fallback.
@@ -823,24 +2594,32 @@ class MyRobotSnake(RobotSnake):
                 non_dying_moves.sort(key=lambda i: i[0])
                 best_move = non_dying_moves[-1][1]
 
-        logger.info('My position: ' + repr(game_state.my_snake.head_pos))
-        logger.info('Next move {!r} score {!r}'.format(best_move, best_score))
+        if self.packed_scores and isinstance(best_score, int):
+            best_score = unpack_heuristic(best_score)
+        logger.info('My position %r, next move %r score %r', game_state.my_snake.head_pos, best_move, best_score)
 
+        game_over = not game_state.my_snake.alive and (self.old_state is None or self.old_state.my_snake.alive)
         # copy the old version of the world for reference
         self.old_state = game_state
 
-        logger.info('Next direction returning after {} ms'.format((time.monotonic() - tick_start_time)*1000))
-        # convert relative move to one of the documented return values
-        # we could have converted to snakepit.datatypes.Vector directly, but it is not documented that it will be
-        # accessible, so it's better to be safe than sorry
-        if best_move == DIR_UP:
-            return self.UP
-        elif best_move == DIR_RIGHT:
-            return self.RIGHT
-        elif best_move == DIR_DOWN:
-            return self.DOWN
-        elif best_move == DIR_LEFT:
-            return self.LEFT
-        else:
-            logger.error('Invalid value of best_move, falling back to the same direction')
-            return None
+        tick_end_time = self.clock.now()
+        self.time_manager.end_tick(tick_end_time)
+        tick_ms = (time.monotonic() - tick_start_wall_time) * 1000
+        logger.info('Next direction returning after %.3f ms', tick_ms)
+        self.telemetry.record('tick_ms', tick_ms)
+        if self.memory_tracer is not None and (
+                game_over or self.telemetry.ticks % self.memory_tracer.count_every == 0):
+            # after the tick's time was measured and only in some ticks, as this walks all the objects
+            self.memory_tracer.count_live_objects()
+        self.telemetry.ticks += 1
+        if self.telemetry_path is not None and (game_over or (
+                self.telemetry_every > 0 and self.telemetry.ticks % self.telemetry_every == 0)):
+            self.telemetry.dump_in_background(self.telemetry_path)
+        if self.recorder is not None:
+            self.recorder.record(game_state.frame_no, game_state.world_size, self.color, bytes(game_state.world),
+                                 best_move, search_depth, tick_ms, search_ms, explored_states)
+            if game_over:
+                # the writer closes the recording after the frame of the death, the interpreter waits for it at exit
+                self.recorder.finish()
+                self.recorder = None
+        return best_move
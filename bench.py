@@ -1,108 +1,304 @@
-from collections import deque
+"""Benchmarks of the snake bot on a library of game scenarios.
 
+Run `python bench.py` to time all the operations on all the scenarios, see `python bench.py --help` for options.
+The module level functions (advance(), observe(), ...) time single operations on the `original` scenario and are
+meant to be used with timeit.
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import sys
 import time
+import timeit
+from collections import deque, namedtuple, OrderedDict
+from typing import List, Tuple, Dict, Optional, Callable
 
-from asnake import Snake, GameState, MyRobotSnake, DIR_RIGHT, XY
+from asnake import Snake, GameState, MyRobotSnake, NodeClock, XY, GAME_CHARS, DIR_RIGHT, DIR_DOWN, DIR_LEFT, \
+    NODE_CLOCK_SECONDS_PER_NODE
 from snakepit.robot_snake import World
-from test_asnake import parse_world
-
-world, world_size = parse_world([
-    '                                                                                ',
-    '  $1*1@1                                                    83                  ',
-    '                                                                                ',
-    '                                                                                ',
-    '                                                                                ',
-    '                                                                                ',
-    '                                                                                ',
-    '                                                                                ',
-    '                                                                                ',
-    '                                                                                ',
-    '                                                                                ',
-    '                                                                                ',
-    '                                                                                ',
-    '                                                                                ',
-    '                                                                                ',
-    '                                                                                ',
-    '                                                                                ',
-    '                                                                                ',
-    '                                                                                ',
-    '                                                                                ',
-    '                                                                                ',
-    '                                                                                ',
-    '                                                                                ',
-    '                                                                                ',
-    '                                                                                ',
-    '                                                                                ',
-    '                                                                                ',
-    '                                                                                ',
-    '                                                                                ',
-    '                                                                                ',
-    '                                                                                ',
-    '                                                                                ',
-    '                                                                                ',
-    '                                                                                ',
-    '                                                                                ',
-    '                                                                                ',
-    '    81                                                                          ',
-    '    81                                                                          ',
-    '                                                                                ',
-    '                                                                                ',
-])
-snake1 = Snake(True, XY(3, 1), XY(1, 1), 1)
-snake1.length = 3
-snake1.head_history = deque([XY(2, 1), XY(1, 1)])
-snake1.grow_uncertain = True
-snake1.grow = 1
-snake1.score = 5
-state = GameState(world, world_size, {1: snake1}, 0)
-state.my_snake = snake1
-robot = MyRobotSnake(World(world_size.x, world_size.y, world))
-snake_directions = {1: DIR_RIGHT}
-
-new_world, new_world_size = parse_world([
-    '                                                                                ',
-    '    $1*1@1                                                  83                  ',
-    '                                                                                ',
-    '                                                                                ',
-    '                                                                                ',
-    '                                                                                ',
-    '                                                                                ',
-    '                                                                                ',
-    '                                                                                ',
-    '                                                                                ',
-    '                                                                                ',
-    '                                                                                ',
-    '                                                                                ',
-    '                                                                                ',
-    '                                                                                ',
-    '                                                                                ',
-    '                                                                                ',
-    '                                                                                ',
-    '                                                                                ',
-    '                                                                                ',
-    '                                                                                ',
-    '                                                                                ',
-    '                                                                                ',
-    '                                                                                ',
-    '                                                                                ',
-    '                                                                                ',
-    '                                                                                ',
-    '                                                                                ',
-    '                                                                                ',
-    '                                                                                ',
-    '                                                                                ',
-    '                                                                                ',
-    '                                                                                ',
-    '                                                                                ',
-    '                                                                                ',
-    '                                                                                ',
-    '    81                                                                          ',
-    '    81                                                                          ',
-    '                                                                                ',
-    '                                                                                ',
-])
-
-new_world_wrapper = World(new_world_size.x, new_world_size.y, new_world)
+
+REVERSE_CHARS = {v: k for k, v in GAME_CHARS.items()}
+
+# my_color is always 1, the world is the observed world of the next tick (after all snakes make `directions`)
+Scenario = namedtuple('Scenario', ('name', 'state', 'directions', 'next_world'))
+
+
+class ScenarioBuilder:
+    """Draws snakes, food and stones into an empty world and makes a game state with fully observed snakes"""
+
+    def __init__(self, size_x: int, size_y: int, seed: int = 0):
+        self.size = XY(size_x, size_y)
+        self.rows = [[(' ', 0)] * size_x for y in range(size_y)]
+        self.snakes = {}  # type: Dict[int, Snake]
+        self.random = random.Random(seed)
+
+    def is_void(self, x: int, y: int) -> bool:
+        return self.rows[y][x][0] == ' '
+
+    def snake(self, color: int, path: List[XY]) -> Snake:
+        """Add a snake, the path goes from tail to head"""
+        for position in path:
+            assert self.is_void(*position), position
+        for position in path[1:-1]:
+            self.rows[position.y][position.x] = ('*', color)
+        self.rows[path[0].y][path[0].x] = ('$', color)
+        self.rows[path[-1].y][path[-1].x] = ('@', color)
+        snake = Snake(True, path[-1], path[0], color)
+        snake.length = len(path)
+        snake.head_history = deque(reversed(path[:-1]))
+        snake.grow_uncertain = False
+        self.snakes[color] = snake
+        return snake
+
+    def food(self, position: XY, value: int, color: int = 0):
+        self.rows[position.y][position.x] = (str(value), color)
+
+    def stones(self, positions: List[XY]):
+        for position in positions:
+            self.rows[position.y][position.x] = ('#', 0)
+
+    def scatter(self, count: int, food: bool = True):
+        """Put food (or stones) at random free positions"""
+        placed = 0
+        while placed < count:
+            x = self.random.randrange(self.size.x)
+            y = self.random.randrange(self.size.y)
+            if self.is_void(x, y):
+                if food:
+                    self.food(XY(x, y), self.random.randint(1, 9))
+                else:
+                    self.stones([XY(x, y)])
+                placed += 1
+
+    def build(self, name: str, directions: Optional[Dict[int, XY]] = None) -> Scenario:
+        state = GameState(self.rows, self.size, self.snakes, 0)
+        state.my_snake = self.snakes[1]
+        enemies = [snake for color, snake in sorted(self.snakes.items()) if color != 1]
+        if enemies:
+            state.enemy_snake = enemies[0]
+        if directions is None:
+            directions = {color: MyRobotSnake.default_move(state, snake) for color, snake in self.snakes.items()}
+        next_state, uncertainty = MyRobotSnake.advance_game(state, directions)
+        return Scenario(name, state, directions, World(self.size.x, self.size.y, world_data(next_state)))
+
+
+def world_data(state: GameState) -> List[List[Tuple[str, int]]]:
+    """Convert the game state's world to the format of snakepit World"""
+    rows = []
+    for y in range(state.world_size.y):
+        row = []
+        for x in range(state.world_size.x):
+            char, color = state.world_get(XY(x, y))
+            row.append((REVERSE_CHARS[char], color))
+        rows.append(row)
+    return rows
+
+
+def line(start: XY, direction: XY, length: int) -> List[XY]:
+    return [XY(start.x + i * direction.x, start.y + i * direction.y) for i in range(length)]
+
+
+def zigzag(start: XY, width: int, length: int) -> List[XY]:
+    """Path that goes right along a row of the given width, then left along the next row, and so on"""
+    path = []
+    y = start.y
+    while len(path) < length:
+        row = [XY(start.x + i, y) for i in range(width)]
+        if (y - start.y) % 2 == 1:
+            row.reverse()
+        path.extend(row)
+        y += 1
+    return path[:length]
+
+
+def original() -> Scenario:
+    """The position bench.py used to have: a short snake on an empty 80x40 board with a few food items"""
+    builder = ScenarioBuilder(80, 40)
+    snake = builder.snake(1, line(XY(1, 1), DIR_RIGHT, 3))
+    snake.grow_uncertain = True
+    snake.grow = 1
+    snake.score = 5
+    builder.food(XY(30, 1), 8, 3)
+    builder.food(XY(2, 36), 8, 1)
+    builder.food(XY(2, 37), 8, 1)
+    return builder.build('original', {1: DIR_RIGHT})
+
+
+def empty(size_x: int, size_y: int) -> Scenario:
+    """One short snake in the middle of an empty board with some food"""
+    builder = ScenarioBuilder(size_x, size_y)
+    builder.snake(1, line(XY(size_x // 2 - 4, size_y // 2), DIR_RIGHT, 5))
+    builder.scatter(size_x * size_y // 200 + 1)
+    return builder.build('empty_{}x{}'.format(size_x, size_y))
+
+
+def dense_midgame() -> Scenario:
+    """Four snakes of medium length, lots of food and scattered stones on 80x40"""
+    builder = ScenarioBuilder(80, 40)
+    builder.snake(1, zigzag(XY(5, 5), 10, 40))
+    builder.snake(2, zigzag(XY(50, 5), 15, 30))
+    builder.snake(3, zigzag(XY(5, 25), 12, 25))
+    builder.snake(4, zigzag(XY(50, 28), 8, 20))
+    builder.scatter(60)
+    builder.scatter(40, food=False)
+    return builder.build('dense_midgame')
+
+
+def two_long_snakes() -> Scenario:
+    """Two snakes of length 300 taking a large part of the 80x40 board"""
+    builder = ScenarioBuilder(80, 40)
+    builder.snake(1, zigzag(XY(2, 2), 30, 300))
+    builder.snake(2, zigzag(XY(45, 2), 30, 300))
+    builder.scatter(20)
+    return builder.build('two_long_snakes')
+
+
+def enclosed() -> Scenario:
+    """Stone walls split the 80x40 board into regions, my snake can't reach the enemy"""
+    builder = ScenarioBuilder(80, 40)
+    builder.stones(line(XY(40, 0), DIR_DOWN, 40))
+    builder.stones(line(XY(0, 20), DIR_RIGHT, 40))
+    builder.snake(1, zigzag(XY(5, 5), 10, 30))
+    builder.snake(2, zigzag(XY(50, 10), 10, 30))
+    builder.scatter(30)
+    return builder.build('enclosed')
+
+
+def near_collision() -> Scenario:
+    """Two snakes heading for each other, their heads three cells apart"""
+    builder = ScenarioBuilder(40, 20)
+    builder.snake(1, line(XY(11, 10), DIR_RIGHT, 8))
+    builder.snake(2, line(XY(28, 10), DIR_LEFT, 8))
+    builder.snake(3, line(XY(20, 2), DIR_DOWN, 6))
+    builder.food(XY(20, 10), 9)
+    builder.scatter(10)
+    return builder.build('near_collision', {1: DIR_RIGHT, 2: DIR_LEFT, 3: DIR_DOWN})
+
+
+SCENARIOS = OrderedDict((
+    ('original', original),
+    ('empty_20x10', lambda: empty(20, 10)),
+    ('empty_80x40', lambda: empty(80, 40)),
+    ('empty_160x80', lambda: empty(160, 80)),
+    ('dense_midgame', dense_midgame),
+    ('two_long_snakes', two_long_snakes),
+    ('enclosed', enclosed),
+    ('near_collision', near_collision),
+))
+
+
+def operations(scenario: Scenario, seconds_per_node: Optional[float] = None) -> Dict[str, Callable[[], object]]:
+    """Return the benchmarked operations on the given scenario
+
+    :param seconds_per_node: if set, next_direction keeps its time limit on a NodeClock, so that it explores the same
+                             nodes in every run and its time depends only on the node rate
+    """
+    state = scenario.state
+    bfs_result = MyRobotSnake.bfs_food_and_partitions(state, None)
+
+    def observe():
+        return MyRobotSnake.observe_state_changes(state, scenario.next_world, 1)
+
+    def advance():
+        return MyRobotSnake.advance_game(state, scenario.directions)
+
+    def bfs():
+        return MyRobotSnake.bfs_food_and_partitions(state, None)
+
+    def heuristic():
+        return MyRobotSnake.heuristic(state, bfs_result, None, 0)
+
+    def search():
+        robot = MyRobotSnake(scenario.next_world, schedule_gc=False)
+        return robot.search_move_space(0, 3, state, None, None, bfs_result)
+
+    def next_direction():
+        # a new robot each time, so that nothing is reused from the previous tick except the observed state
+        # garbage is collected by timeit between the repetitions, not by a background thread
+        if seconds_per_node is None:
+            robot = MyRobotSnake(scenario.next_world, schedule_gc=False)
+        else:
+            robot = MyRobotSnake(scenario.next_world, schedule_gc=False, clock=NodeClock(seconds_per_node))
+        robot.color = 1
+        robot.old_state = state
+        robot.frame_no = state.frame_no
+        return robot.next_direction()
+
+    return OrderedDict((
+        ('observe', observe),
+        ('advance', advance),
+        ('bfs', bfs),
+        ('heuristic', heuristic),
+        ('search', search),
+        ('next_direction', next_direction),
+    ))
+
+
+def measure(function: Callable[[], object], repeat: int, min_time: float) -> float:
+    """Return the best time of a single call in seconds"""
+    timer = timeit.Timer(function)
+    number = 1
+    while timer.timeit(number) < min_time:
+        number *= 2
+    return min(timer.repeat(repeat, number)) / number
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('-s', '--scenario', action='append', choices=list(SCENARIOS),
+                        help='scenario to run, can be repeated (default: all)')
+    parser.add_argument('-o', '--operation', action='append',
+                        help='operation to time, can be repeated (default: all)')
+    parser.add_argument('--json', help='write the results to this file as JSON')
+    parser.add_argument('--baseline', help='JSON results of a previous run to compare with')
+    parser.add_argument('--node-clock', type=float, nargs='?', const=NODE_CLOCK_SECONDS_PER_NODE,
+                        metavar='SECONDS_PER_NODE',
+                        help='run next_direction with a time limit in counted search nodes instead of wall time '
+                             '(default: %(const)s s/node)')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--min-time', type=float, default=0.05, help='minimal time of one repetition in seconds')
+    args = parser.parse_args(argv)
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+
+    results = OrderedDict()
+    for scenario_name in args.scenario or SCENARIOS:
+        scenario = SCENARIOS[scenario_name]()
+        for operation_name, function in operations(scenario, args.node_clock).items():
+            if args.operation and operation_name not in args.operation:
+                continue
+            key = '{}/{}'.format(scenario_name, operation_name)
+            results[key] = seconds = measure(function, args.repeat, args.min_time)
+            comparison = ''
+            if key in baseline:
+                comparison = '  {:6.2f}x baseline'.format(seconds / baseline[key])
+            print('{:40} {:12.1f} us{}'.format(key, seconds * 1e6, comparison))
+            sys.stdout.flush()
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'python': platform.python_version(), 'results': results}, f, indent=2)
+
+
+# single operations on the original scenario, for use with timeit and profilers
+scenario = original()
+state = scenario.state
+robot = MyRobotSnake(World(state.world_size.x, state.world_size.y, world_data(state)), schedule_gc=False)
+robot.color = 1
+snake_directions = scenario.directions
+new_world_wrapper = scenario.next_world
+bfs_result = robot.bfs_food_and_partitions(state, None)
+
+
+def enable_logging(level=logging.INFO):
+    """Send the bot's log to /dev/null at the given level, to measure the cost of logging"""
+    logging.basicConfig(level=level, stream=open(os.devnull, 'w'))
 
 
 def advance():
@@ -113,8 +309,8 @@ def observe():
     return robot.observe_state_changes(state, new_world_wrapper, 1)
 
 
-def search():
-    return robot.search_move_space(3, state, robot.heuristic)
+def search(depth=3):
+    return robot.search_move_space(0, depth, state, None, None, bfs_result)
 
 
 def bfs(time_limit=None):
@@ -125,4 +321,5 @@ def bfs(time_limit=None):
     return robot.bfs_food_and_partitions(state, deadline=deadline)
 
 
-#print(timeit.timeit('robot.advance_game(state, snake_directions)', globals=globals(), number=1000))
+if __name__ == '__main__':
+    main()
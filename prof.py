@@ -1,4 +0,0 @@
-import bench
-
-for i in range(100000):
-    bench.advance()
\ No newline at end of file
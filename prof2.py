@@ -1,4 +0,0 @@
-import bench
-
-for i in range(1000):
-    bench.observe()
@@ -0,0 +1,186 @@
+"""Replays recorded games through a fresh bot, without the game server.
+
+Run `python replay.py game-*.rec` to feed the frames recorded by `MyRobotSnake(world, record_dir=...)` to a new
+MyRobotSnake and report the tick latency, the search depth reached and the ticks where the bot chose a different
+move than in the recording. See `python replay.py --help` for options.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from collections import namedtuple
+from typing import List, Optional, Tuple
+
+from asnake import GameRecording, MyRobotSnake, NodeClock, RecordedFrame, TimeManager, GAME_CHARS, XY, DIR_UP, \
+    DIR_RIGHT, DIR_DOWN, DIR_LEFT, SEARCH_MINIMAX, SEARCH_PARANOID, SEARCH_MAXN, SEARCH_MCTS, \
+    NODE_CLOCK_SECONDS_PER_NODE
+from snakepit.robot_snake import World
+
+REVERSE_CHARS = {v: k for k, v in GAME_CHARS.items()}
+# (char, color) of the World for each byte of the GameState world
+DECODED_CELLS = [(REVERSE_CHARS.get(byte & 0x1f, ' '), byte >> 5) for byte in range(256)]
+DIRECTION_NAMES = {DIR_UP: 'up', DIR_RIGHT: 'right', DIR_DOWN: 'down', DIR_LEFT: 'left', None: 'none'}
+
+ReplayedTick = namedtuple('ReplayedTick', ('frame_no', 'latency_ms', 'recorded_ms', 'search_depth', 'recorded_depth',
+                                           'move', 'recorded_move'))
+
+
+def game_frame_interval(frame_no: int) -> float:
+    """Interval between the frames of the game: 9 frames per second at the beginning, 60 later"""
+    return 1 / 9.0 if frame_no < 1024 else 1 / 60.0
+
+
+class ReplayTimeManager(TimeManager):
+    """Time manager that sees the frames arriving at the game's frame interval, however fast they are replayed.
+
+    The tick starts are taken from a virtual clock that advances by the frame interval every frame (also the frames
+    the recording bot missed), the time spent in a tick is still measured by the bot's clock.
+    """
+    __slots__ = 'interval', 'virtual_time', 'tick_start'
+
+    def __init__(self, frame_interval: Optional[float] = None):
+        super(ReplayTimeManager, self).__init__()
+        self.interval = frame_interval  # None means the interval of the game, see game_frame_interval
+        self.virtual_time = 0.0
+        self.tick_start = None  # type: Optional[float]
+
+    def start_tick(self, now: float, frame_no: int, frame_time: Optional[float] = None) -> float:
+        self.tick_start = now
+        frames = 1 if self.last_frame_no is None else max(1, frame_no - self.last_frame_no)
+        self.virtual_time += frames * (self.interval or game_frame_interval(frame_no))
+        return super(ReplayTimeManager, self).start_tick(self.virtual_time, frame_no)
+
+    def end_tick(self, now: float):
+        self.overruns.append(max(0.0, now - self.tick_start - self.time_limit))
+
+
+def world_data(frame: RecordedFrame) -> List[List[Tuple[str, int]]]:
+    """Convert the recorded world to the format of snakepit World"""
+    size_x = frame.world_size.x
+    world = frame.world
+    return [[DECODED_CELLS[byte] for byte in world[y * size_x:(y + 1) * size_x]] for y in range(frame.world_size.y)]
+
+
+def replay(path: str, realtime: bool = False, frame_interval: Optional[float] = None, seed: int = 0,
+           **robot_kwargs) -> List[ReplayedTick]:
+    """Feed the frames of a recording to a new bot and return what happened in each tick.
+
+    :param realtime: if true, the frames are fed at the frame interval in wall time, otherwise as fast as the bot
+                     replies, with the bot's time manager on a virtual clock of the frame interval
+    :param frame_interval: interval between frames in seconds, None means the interval of the game
+    :param robot_kwargs: passed to MyRobotSnake, which by default doesn't record, profile or trace memory
+                         regardless of the environment
+    """
+    random.seed(seed)
+    # the replay mustn't write a new recording of itself, or slow itself down, because of the bot's environment
+    robot_kwargs.setdefault('record_dir', '')
+    robot_kwargs.setdefault('profile_dir', '')
+    robot_kwargs.setdefault('trace_memory', False)
+    ticks = []
+    with GameRecording(path) as recording:
+        world = None
+        robot = None
+        next_frame_time = time.monotonic()
+        last_frame_no = None
+        for frame in recording:
+            if robot is None:
+                # the game server changes the world of the robot in place, so does the replay
+                world = World(frame.world_size.x, frame.world_size.y, world_data(frame))
+                robot = MyRobotSnake(world, **robot_kwargs)
+                robot.color = frame.color
+                if not realtime:
+                    robot.time_manager = ReplayTimeManager(frame_interval)
+            else:
+                world.worlddata = world_data(frame)
+
+            if realtime:
+                # the frames the recording bot missed pass by too
+                if last_frame_no is not None:
+                    next_frame_time += (frame.frame_no - last_frame_no) * (
+                        frame_interval or game_frame_interval(frame.frame_no))
+                last_frame_no = frame.frame_no
+                delay = next_frame_time - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+            elif robot.gc_scheduler is not None:
+                # the game would wait for the next frame here, which gives the collection after the last tick time
+                robot.gc_scheduler.idle.wait()
+
+            robot.search_depth = 0
+            start_time = time.perf_counter()
+            direction = robot.next_direction()
+            latency = time.perf_counter() - start_time
+            move = None if direction is None else XY(*direction)
+            ticks.append(ReplayedTick(frame.frame_no, latency * 1000, frame.tick_ms, robot.search_depth,
+                                      frame.search_depth, move, frame.move))
+        frame = None  # release the view of the recording, so that it can be unmapped
+    return ticks
+
+
+def quantile(values: List[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def summary(name: str, ticks: List[ReplayedTick]) -> str:
+    latencies = [tick.latency_ms for tick in ticks]
+    differences = sum(1 for tick in ticks if tick.move != tick.recorded_move)
+    return '{:40} {:6d} ticks  latency p50 {:6.1f} p99 {:6.1f} max {:6.1f} ms (recorded p50 {:6.1f})  ' \
+           'depth {:5.2f} (recorded {:5.2f})  {:5d} different moves'.format(
+            name, len(ticks), quantile(latencies, 0.5), quantile(latencies, 0.99), max(latencies),
+            quantile([tick.recorded_ms for tick in ticks], 0.5),
+            sum(tick.search_depth for tick in ticks) / len(ticks),
+            sum(tick.recorded_depth for tick in ticks) / len(ticks), differences)
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('recordings', nargs='+', help='recorded games, each is replayed by a new bot')
+    parser.add_argument('--realtime', action='store_true',
+                        help='feed the frames at the frame interval in wall time instead of at full speed')
+    parser.add_argument('--frame-interval', type=float,
+                        help='interval between frames in seconds (default: 1/9 for the first 1024 frames, then 1/60)')
+    parser.add_argument('--node-clock', type=float, nargs='?', const=NODE_CLOCK_SECONDS_PER_NODE,
+                        metavar='SECONDS_PER_NODE',
+                        help='keep the time limits on a virtual clock that counts search nodes instead of wall time, '
+                             'so that the replay explores the same nodes on any machine (default: %(const)s s/node)')
+    parser.add_argument('--search-mode', default=SEARCH_MINIMAX,
+                        choices=[SEARCH_MINIMAX, SEARCH_PARANOID, SEARCH_MAXN, SEARCH_MCTS])
+    parser.add_argument('--seed', type=int, default=0, help='seed of the random number generator of each replay')
+    parser.add_argument('--diffs', action='store_true', help='list the ticks with a different move')
+    parser.add_argument('--json', help='write all the replayed ticks to this file as JSON')
+    args = parser.parse_args(argv)
+    if args.realtime and args.node_clock is not None:
+        parser.error('--node-clock can be used only at full speed')
+
+    results = {}
+    all_ticks = []
+    for path in args.recordings:
+        robot_kwargs = {'search_mode': args.search_mode}
+        if args.node_clock is not None:
+            robot_kwargs['clock'] = NodeClock(args.node_clock)
+        ticks = replay(path, args.realtime, args.frame_interval, args.seed, **robot_kwargs)
+        results[path] = [tick._asdict() for tick in ticks]
+        if not ticks:
+            print('{:40} no frames'.format(os.path.basename(path)))
+            continue
+        all_ticks.extend(ticks)
+        print(summary(os.path.basename(path), ticks))
+        if args.diffs:
+            for tick in ticks:
+                if tick.move != tick.recorded_move:
+                    print('  frame {:6d}: recorded {}, replayed {}'.format(
+                        tick.frame_no, DIRECTION_NAMES[tick.recorded_move], DIRECTION_NAMES[tick.move]))
+        sys.stdout.flush()
+    if len(args.recordings) > 1 and all_ticks:
+        print(summary('total', all_ticks))
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
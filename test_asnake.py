@@ -1,7 +1,21 @@
+import gc
+import json
+import pstats
+import random
+import sys
+import threading
+import time
+import tracemalloc
 from collections import deque
 from typing import Tuple, List
 
-from asnake import GameState, Snake, MyRobotSnake, DIR_DOWN, DIR_RIGHT, DIR_UP, GAME_CHARS, XY
+import pytest
+
+from asnake import GameState, Snake, MyRobotSnake, MoveGenerator, HeuristicCache, Heuristic, pack_heuristic, \
+    unpack_heuristic, TimeManager, TIME_SAMPLES, Deadline, NodeClock, SearchTimedOut, Histogram, \
+    TickProfiler, PROFILE_EVERY, GCScheduler, StatePool, GameRecorder, GameRecording, RECORD_INDEX_SUFFIX, DIR_DOWN, \
+    DIR_LEFT, RECORD_FRAME_HEADER, RECORD_INDEX_ENTRY, DIR_RIGHT, DIR_UP, GAME_CHARS, XY
+from replay import replay, world_data, ReplayTimeManager
 from snakepit.robot_snake import World
 
 
@@ -109,6 +123,34 @@ def test_observe_state_changes_first():
     assert my_snake.tail_pos == XY(1, 1)
 
 
+def test_observe_state_changes_missed_frames():
+    world, world_size = parse_world([
+        '$1*1*1*1@1          ',
+        '                    ',
+        '  $2*2@2            ',
+    ])
+    old_state = MyRobotSnake.observe_state_changes(None, World(world_size.x, world_size.y, world), 1)
+    assert old_state.frame_no == 0
+
+    # snake 1 moved by two positions, its old head is two positions back in the body
+    world, world_size = parse_world([
+        '    $1*1*1*1@1      ',
+        '                    ',
+        '  $2*2@2            ',
+    ])
+    game_state = MyRobotSnake.observe_state_changes(old_state, World(world_size.x, world_size.y, world), 1)
+    assert game_state.frame_no == 2
+
+    # snake 2 is shorter than the distance it moved
+    world, world_size = parse_world([
+        '        $1*1*1*1@1  ',
+        '                    ',
+        '            $2*2@2  ',
+    ])
+    game_state = MyRobotSnake.observe_state_changes(game_state, World(world_size.x, world_size.y, world), 1)
+    assert game_state.frame_no == 7
+
+
 def test_observe_state_changes_nontraceable():
     world, world_size = parse_world([
         '        ',
@@ -1937,3 +1979,1325 @@ def test_advance_game_double_mutual_body_kill():
     assert new_snake2.grow == 0
     assert new_snake2.score == 6
     assert not new_snake2.grow_uncertain
+
+
+def test_advance_game_triple_tail_chase_cycle():
+    world, world_size = parse_world([
+        '$1*1@1$2*2  ',
+        '@3*3*3$3@2  ',
+        '            ',
+    ])
+    snake1 = Snake(True, XY(2, 0), XY(0, 0), 1)
+    snake1.grow = 0
+    snake1.grow_uncertain = False
+    snake1.length = 3
+    snake1.score = 4
+    snake1.head_history = deque([XY(1, 0), XY(0, 0)])
+
+    snake2 = Snake(True, XY(4, 1), XY(3, 0), 2)
+    snake2.grow = 0
+    snake2.grow_uncertain = False
+    snake2.length = 3
+    snake2.score = 6
+    snake2.head_history = deque([XY(4, 0), XY(3, 0)])
+
+    snake3 = Snake(True, XY(0, 1), XY(3, 1), 3)
+    snake3.grow = 0
+    snake3.grow_uncertain = False
+    snake3.length = 4
+    snake3.score = 8
+    snake3.head_history = deque([XY(1, 1), XY(2, 1), XY(3, 1)])
+
+    game_state = GameState(world, world_size, {1: snake1, 2: snake2, 3: snake3}, 0)
+
+    robot = MyRobotSnake(World(world_size.x, world_size.y, world))
+    new_state, uncertainty = robot.advance_game(game_state, {1: DIR_RIGHT, 2: DIR_LEFT, 3: DIR_UP})
+
+    assert not uncertainty
+    assert serialize_world(new_state) == [
+        '@3$1*1@1$2  ',
+        '*3*3$3@2*2  ',
+        '            ',
+    ]
+    new_snake1 = new_state.snakes_by_color[1]
+    assert new_snake1.alive
+    assert list(new_snake1.head_history) == [XY(2, 0), XY(1, 0)]
+    assert new_snake1.length == 3
+    assert new_snake1.score == 4
+
+    new_snake2 = new_state.snakes_by_color[2]
+    assert new_snake2.alive
+    assert list(new_snake2.head_history) == [XY(4, 1), XY(4, 0)]
+    assert new_snake2.length == 3
+    assert new_snake2.score == 6
+
+    new_snake3 = new_state.snakes_by_color[3]
+    assert new_snake3.alive
+    assert list(new_snake3.head_history) == [XY(0, 1), XY(1, 1), XY(2, 1)]
+    assert new_snake3.length == 4
+    assert new_snake3.score == 8
+
+
+def test_advance_game_triple_tail_chase_cycle_grow():
+    world, world_size = parse_world([
+        '$1*1@1$2*2  ',
+        '@3*3*3$3@2  ',
+        '            ',
+    ])
+    snake1 = Snake(True, XY(2, 0), XY(0, 0), 1)
+    snake1.grow = 0
+    snake1.grow_uncertain = False
+    snake1.length = 3
+    snake1.score = 4
+    snake1.head_history = deque([XY(1, 0), XY(0, 0)])
+
+    snake2 = Snake(True, XY(4, 1), XY(3, 0), 2)
+    snake2.grow = 0
+    snake2.grow_uncertain = False
+    snake2.length = 3
+    snake2.score = 6
+    snake2.head_history = deque([XY(4, 0), XY(3, 0)])
+
+    snake3 = Snake(True, XY(0, 1), XY(3, 1), 3)
+    snake3.grow = 1
+    snake3.grow_uncertain = False
+    snake3.length = 4
+    snake3.score = 8
+    snake3.head_history = deque([XY(1, 1), XY(2, 1), XY(3, 1)])
+
+    game_state = GameState(world, world_size, {1: snake1, 2: snake2, 3: snake3}, 0)
+
+    robot = MyRobotSnake(World(world_size.x, world_size.y, world))
+    new_state, uncertainty = robot.advance_game(game_state, {1: DIR_RIGHT, 2: DIR_LEFT, 3: DIR_UP})
+
+    assert not uncertainty
+    assert serialize_world(new_state) == [
+        '% + x % +   ',
+        'x + + % x   ',
+        '            ',
+    ]
+    new_snake1 = new_state.snakes_by_color[1]
+    assert not new_snake1.alive
+    assert list(new_snake1.head_history) == [XY(1, 0), XY(0, 0)]
+    assert new_snake1.score == 4
+
+    new_snake2 = new_state.snakes_by_color[2]
+    assert not new_snake2.alive
+    assert list(new_snake2.head_history) == [XY(4, 0), XY(3, 0)]
+    assert new_snake2.score == 6
+
+    new_snake3 = new_state.snakes_by_color[3]
+    assert not new_snake3.alive
+    assert list(new_snake3.head_history) == [XY(1, 1), XY(2, 1), XY(3, 1)]
+    assert new_snake3.length == 4
+    assert new_snake3.grow == 1
+    assert new_snake3.score == 8
+
+
+def test_advance_game_triple_tail_chase_chain():
+    world, world_size = parse_world([
+        '$1*1@1$2*2@2$3*3@35 ',
+        '                    ',
+    ])
+    snake1 = Snake(True, XY(2, 0), XY(0, 0), 1)
+    snake1.grow = 0
+    snake1.grow_uncertain = False
+    snake1.length = 3
+    snake1.score = 4
+    snake1.head_history = deque([XY(1, 0), XY(0, 0)])
+
+    snake2 = Snake(True, XY(5, 0), XY(3, 0), 2)
+    snake2.grow = 0
+    snake2.grow_uncertain = False
+    snake2.length = 3
+    snake2.score = 6
+    snake2.head_history = deque([XY(4, 0), XY(3, 0)])
+
+    snake3 = Snake(True, XY(8, 0), XY(6, 0), 3)
+    snake3.grow = 0
+    snake3.grow_uncertain = False
+    snake3.length = 3
+    snake3.score = 8
+    snake3.head_history = deque([XY(7, 0), XY(6, 0)])
+
+    game_state = GameState(world, world_size, {1: snake1, 2: snake2, 3: snake3}, 0)
+
+    robot = MyRobotSnake(World(world_size.x, world_size.y, world))
+    new_state, uncertainty = robot.advance_game(game_state, {1: DIR_RIGHT, 2: DIR_RIGHT, 3: DIR_RIGHT})
+
+    assert not uncertainty
+    assert serialize_world(new_state) == [
+        '  $1*1@1$2*2@2$3*3@3',
+        '                    ',
+    ]
+    new_snake1 = new_state.snakes_by_color[1]
+    assert new_snake1.alive
+    assert list(new_snake1.head_history) == [XY(2, 0), XY(1, 0)]
+    assert new_snake1.score == 4
+
+    new_snake2 = new_state.snakes_by_color[2]
+    assert new_snake2.alive
+    assert list(new_snake2.head_history) == [XY(5, 0), XY(4, 0)]
+    assert new_snake2.score == 6
+
+    new_snake3 = new_state.snakes_by_color[3]
+    assert new_snake3.alive
+    assert list(new_snake3.head_history) == [XY(8, 0), XY(7, 0)]
+    assert new_snake3.length == 3
+    assert new_snake3.grow == 5
+    assert new_snake3.score == 13
+
+
+def test_advance_game_triple_tail_chase_chain_crash():
+    world, world_size = parse_world([
+        '$1*1@1$2*2@2$3*3@3# ',
+        '                    ',
+    ])
+    snake1 = Snake(True, XY(2, 0), XY(0, 0), 1)
+    snake1.grow = 0
+    snake1.grow_uncertain = False
+    snake1.length = 3
+    snake1.score = 4
+    snake1.head_history = deque([XY(1, 0), XY(0, 0)])
+
+    snake2 = Snake(True, XY(5, 0), XY(3, 0), 2)
+    snake2.grow = 0
+    snake2.grow_uncertain = False
+    snake2.length = 3
+    snake2.score = 6
+    snake2.head_history = deque([XY(4, 0), XY(3, 0)])
+
+    snake3 = Snake(True, XY(8, 0), XY(6, 0), 3)
+    snake3.grow = 0
+    snake3.grow_uncertain = False
+    snake3.length = 3
+    snake3.score = 8
+    snake3.head_history = deque([XY(7, 0), XY(6, 0)])
+
+    game_state = GameState(world, world_size, {1: snake1, 2: snake2, 3: snake3}, 0)
+
+    robot = MyRobotSnake(World(world_size.x, world_size.y, world))
+    new_state, uncertainty = robot.advance_game(game_state, {1: DIR_RIGHT, 2: DIR_RIGHT, 3: DIR_RIGHT})
+
+    assert not uncertainty
+    assert serialize_world(new_state) == [
+        '% + x % + x % + x # ',
+        '                    ',
+    ]
+    for color, score in ((1, 4), (2, 6), (3, 8)):
+        new_snake = new_state.snakes_by_color[color]
+        assert not new_snake.alive
+        assert new_snake.length == 3
+        assert new_snake.score == score
+
+
+def test_advance_game_triple_tail_chase_chain_grow_kill():
+    world, world_size = parse_world([
+        '$1*1@1$2*2@2$3*3@3  ',
+        '                    ',
+    ])
+    snake1 = Snake(True, XY(2, 0), XY(0, 0), 1)
+    snake1.grow = 0
+    snake1.grow_uncertain = False
+    snake1.length = 3
+    snake1.score = 4
+    snake1.head_history = deque([XY(1, 0), XY(0, 0)])
+
+    snake2 = Snake(True, XY(5, 0), XY(3, 0), 2)
+    snake2.grow = 0
+    snake2.grow_uncertain = False
+    snake2.length = 3
+    snake2.score = 6
+    snake2.head_history = deque([XY(4, 0), XY(3, 0)])
+
+    snake3 = Snake(True, XY(8, 0), XY(6, 0), 3)
+    snake3.grow = 1
+    snake3.grow_uncertain = False
+    snake3.length = 3
+    snake3.score = 8
+    snake3.head_history = deque([XY(7, 0), XY(6, 0)])
+
+    game_state = GameState(world, world_size, {1: snake1, 2: snake2, 3: snake3}, 0)
+
+    robot = MyRobotSnake(World(world_size.x, world_size.y, world))
+    new_state, uncertainty = robot.advance_game(game_state, {1: DIR_RIGHT, 2: DIR_RIGHT, 3: DIR_RIGHT})
+
+    assert not uncertainty
+    assert serialize_world(new_state) == [
+        '% + x % + x $3*3*3@3',
+        '                    ',
+    ]
+    new_snake1 = new_state.snakes_by_color[1]
+    assert not new_snake1.alive
+    assert new_snake1.score == 4
+
+    new_snake2 = new_state.snakes_by_color[2]
+    assert not new_snake2.alive
+    assert new_snake2.score == 6
+
+    new_snake3 = new_state.snakes_by_color[3]
+    assert new_snake3.alive
+    assert list(new_snake3.head_history) == [XY(8, 0), XY(7, 0), XY(6, 0)]
+    assert new_snake3.length == 4
+    assert new_snake3.grow == 0
+    assert new_snake3.score == 1008
+
+
+def test_advance_game_triple_frontal_crash():
+    world, world_size = parse_world([
+        '          ',
+        '$1      $2',
+        '*1@19 @2*2',
+        '    @3    ',
+        '  $3*3    ',
+    ])
+    snake1 = Snake(True, XY(1, 2), XY(0, 1), 1)
+    snake1.grow = 0
+    snake1.grow_uncertain = False
+    snake1.length = 3
+    snake1.score = 4
+    snake1.head_history = deque([XY(0, 2), XY(0, 1)])
+
+    snake2 = Snake(True, XY(3, 2), XY(4, 1), 2)
+    snake2.grow = 0
+    snake2.grow_uncertain = False
+    snake2.length = 3
+    snake2.score = 6
+    snake2.head_history = deque([XY(4, 2), XY(4, 1)])
+
+    snake3 = Snake(True, XY(2, 3), XY(1, 4), 3)
+    snake3.grow = 0
+    snake3.grow_uncertain = False
+    snake3.length = 3
+    snake3.score = 8
+    snake3.head_history = deque([XY(2, 4), XY(1, 4)])
+
+    game_state = GameState(world, world_size, {1: snake1, 2: snake2, 3: snake3}, 0)
+
+    robot = MyRobotSnake(World(world_size.x, world_size.y, world))
+    new_state, uncertainty = robot.advance_game(game_state, {1: DIR_RIGHT, 2: DIR_LEFT, 3: DIR_UP})
+
+    assert not uncertainty
+    assert serialize_world(new_state) == [
+        '          ',
+        '          ',
+        '% + x + % ',
+        '    +     ',
+        '    %     ',
+    ]
+    new_snake1 = new_state.snakes_by_color[1]
+    assert not new_snake1.alive
+    assert list(new_snake1.head_history) == [XY(1, 2), XY(0, 2)]
+    assert new_snake1.grow == 0
+    assert new_snake1.score == 4
+
+    new_snake2 = new_state.snakes_by_color[2]
+    assert not new_snake2.alive
+    assert list(new_snake2.head_history) == [XY(3, 2), XY(4, 2)]
+    assert new_snake2.grow == 0
+    assert new_snake2.score == 6
+
+    new_snake3 = new_state.snakes_by_color[3]
+    assert not new_snake3.alive
+    assert list(new_snake3.head_history) == [XY(2, 3), XY(2, 4)]
+    assert new_snake3.grow == 0
+    assert new_snake3.score == 8
+
+
+def test_advance_game_triple_double_body_kill():
+    world, world_size = parse_world([
+        '  @1*1$1',
+        '$3*3*3@3',
+        '$2*2@2  ',
+        '        ',
+    ])
+    snake1 = Snake(True, XY(1, 0), XY(3, 0), 1)
+    snake1.grow = 0
+    snake1.grow_uncertain = False
+    snake1.length = 3
+    snake1.score = 4
+    snake1.head_history = deque([XY(2, 0), XY(3, 0)])
+
+    snake2 = Snake(True, XY(2, 2), XY(0, 2), 2)
+    snake2.grow = 0
+    snake2.grow_uncertain = False
+    snake2.length = 3
+    snake2.score = 6
+    snake2.head_history = deque([XY(1, 2), XY(0, 2)])
+
+    snake3 = Snake(True, XY(3, 1), XY(0, 1), 3)
+    snake3.grow = 0
+    snake3.grow_uncertain = False
+    snake3.length = 4
+    snake3.score = 8
+    snake3.head_history = deque([XY(2, 1), XY(1, 1), XY(0, 1)])
+
+    game_state = GameState(world, world_size, {1: snake1, 2: snake2, 3: snake3}, 0)
+
+    robot = MyRobotSnake(World(world_size.x, world_size.y, world))
+    new_state, uncertainty = robot.advance_game(game_state, {1: DIR_DOWN, 2: DIR_UP, 3: DIR_DOWN})
+
+    assert not uncertainty
+    assert serialize_world(new_state) == [
+        '  x + % ',
+        '  $3*3*3',
+        '% + x @3',
+        '        ',
+    ]
+    new_snake1 = new_state.snakes_by_color[1]
+    assert not new_snake1.alive
+    assert new_snake1.score == 4
+
+    new_snake2 = new_state.snakes_by_color[2]
+    assert not new_snake2.alive
+    assert new_snake2.score == 6
+
+    new_snake3 = new_state.snakes_by_color[3]
+    assert new_snake3.alive
+    assert list(new_snake3.head_history) == [XY(3, 1), XY(2, 1), XY(1, 1)]
+    assert new_snake3.length == 4
+    assert new_snake3.score == 2008
+
+
+def three_snake_crossroads():
+    """My snake in the middle, each of two enemies can reach one of my next positions, food lures me left"""
+    world, world_size = parse_world([
+        '    @2*2$2',
+        '          ',
+        '@39 @1    ',
+        '*3  *1    ',
+        '$3  $1    ',
+    ])
+    snake1 = Snake(True, XY(2, 2), XY(2, 4), 1)
+    snake1.grow_uncertain = False
+    snake1.length = 3
+    snake1.head_history = deque([XY(2, 3), XY(2, 4)])
+
+    snake2 = Snake(True, XY(2, 0), XY(4, 0), 2)
+    snake2.grow_uncertain = False
+    snake2.length = 3
+    snake2.head_history = deque([XY(3, 0), XY(4, 0)])
+
+    snake3 = Snake(True, XY(0, 2), XY(0, 4), 3)
+    snake3.grow_uncertain = False
+    snake3.length = 3
+    snake3.head_history = deque([XY(0, 3), XY(0, 4)])
+
+    game_state = GameState(world, world_size, {1: snake1, 2: snake2, 3: snake3}, 0)
+    game_state.my_snake = snake1
+    game_state.enemy_snake = snake2
+    return game_state, World(world_size.x, world_size.y, world)
+
+
+def test_relevant_enemies():
+    game_state, world = three_snake_crossroads()
+
+    assert MyRobotSnake.relevant_enemies(game_state, 1) == [game_state.snakes_by_color[2],
+                                                            game_state.snakes_by_color[3]]
+    assert MyRobotSnake.relevant_enemies(game_state, 0) == []
+
+    game_state.snakes_by_color[3].alive = False
+    assert MyRobotSnake.relevant_enemies(game_state, 1) == [game_state.snakes_by_color[2]]
+
+
+def test_search_move_space_modes():
+    game_state, world = three_snake_crossroads()
+    robot = MyRobotSnake(world)
+    bfs = robot.bfs_food_and_partitions(game_state, None)
+
+    # minimax only considers the first enemy, so it goes for the food
+    score, move, explored_states, explored_all = robot.search_move_space(0, 1, game_state, None, None, bfs)
+    assert move == DIR_LEFT
+
+    # paranoid search expects the other enemy to crash into me
+    score, move, explored_states, explored_all = robot.search_move_space_paranoid(0, 1, game_state, None, None, bfs)
+    assert move == DIR_RIGHT
+    assert score.liveness == 0
+
+    # max-n expects the enemies not to commit suicide
+    scores, move, explored_states, explored_all = robot.search_move_space_maxn(0, 1, game_state, None, None, bfs)
+    assert move == DIR_LEFT
+    assert scores[1].score == 9
+    assert scores[3] == (True, -9, 3)
+
+
+def test_search_move_space_paranoid_pruning():
+    world, world_size = parse_world([
+        '            ',
+        '  $1*1@1    ',
+        '     5      ',
+        '    @2*2$2  ',
+        '            ',
+        '            ',
+    ])
+    snake1 = Snake(True, XY(3, 1), XY(1, 1), 1)
+    snake1.grow_uncertain = False
+    snake1.length = 3
+    snake1.head_history = deque([XY(2, 1), XY(1, 1)])
+
+    snake2 = Snake(True, XY(2, 3), XY(4, 3), 2)
+    snake2.grow_uncertain = False
+    snake2.length = 3
+    snake2.head_history = deque([XY(3, 3), XY(4, 3)])
+
+    game_state = GameState(world, world_size, {1: snake1, 2: snake2}, 0)
+    game_state.my_snake = snake1
+    game_state.enemy_snake = snake2
+    robot = MyRobotSnake(World(world_size.x, world_size.y, world))
+    bfs = robot.bfs_food_and_partitions(game_state, None)
+
+    for max_depth in range(1, 4):
+        score, move, explored_states, _ = robot.search_move_space(0, max_depth, game_state, None, None, bfs)
+        paranoid_score, paranoid_move, paranoid_explored_states, _ = robot.search_move_space_paranoid(
+            0, max_depth, game_state, None, None, bfs)
+        assert paranoid_score == score
+        assert paranoid_move == move
+        assert paranoid_explored_states <= explored_states
+
+
+def two_distant_snakes():
+    world, world_size = parse_world([
+        '                                        ',
+        '  $1*1@1                                ',
+        '                                        ',
+        '                                        ',
+        '                                $2*2@2  ',
+        '                                      # ',
+        '                                        ',
+    ])
+    snake1 = Snake(True, XY(3, 1), XY(1, 1), 1)
+    snake1.grow_uncertain = False
+    snake1.length = 3
+    snake1.head_history = deque([XY(2, 1), XY(1, 1)])
+
+    snake2 = Snake(True, XY(18, 4), XY(16, 4), 2)
+    snake2.grow_uncertain = False
+    snake2.length = 3
+    snake2.head_history = deque([XY(17, 4), XY(16, 4)])
+
+    game_state = GameState(world, world_size, {1: snake1, 2: snake2}, 0)
+    game_state.my_snake = snake1
+    game_state.enemy_snake = snake2
+    return game_state, World(world_size.x, world_size.y, world)
+
+
+def test_heads_apart():
+    game_state, world = two_distant_snakes()
+    snake1 = game_state.snakes_by_color[1]
+    snake2 = game_state.snakes_by_color[2]
+
+    # manhattan distance of the heads is 18
+    assert MyRobotSnake.heads_apart(snake1, snake2, 8)
+    assert not MyRobotSnake.heads_apart(snake1, snake2, 9)
+
+
+def test_default_move():
+    game_state, world = two_distant_snakes()
+
+    assert MyRobotSnake.default_move(game_state, game_state.snakes_by_color[1]) == DIR_RIGHT
+    game_state.snakes_by_color[2].head_pos = XY(19, 4)
+    game_state.snakes_by_color[2].head_history = deque([XY(18, 4), XY(17, 4)])
+    # wall ahead, stone below
+    assert MyRobotSnake.default_move(game_state, game_state.snakes_by_color[2]) == DIR_UP
+
+
+def test_search_move_space_decoupled():
+    game_state, world = two_distant_snakes()
+    robot = MyRobotSnake(world)
+    bfs = robot.bfs_food_and_partitions(game_state, None)
+
+    score, move, explored_states, explored_all = robot.search_move_space(0, 3, game_state, None, None, bfs)
+    # the enemy is not branched and moves into the wall at the top are not generated
+    assert explored_states == 3 + (2 + 3 + 3) + (2 * 3 + 3 * 3 + 2 + 2 * 2)
+    assert not explored_all
+    assert score.liveness == 0
+
+
+def two_separated_snakes():
+    world, world_size = parse_world([
+        '            # $2*2@2',
+        '            # 5     ',
+        '  $1*1@1    # # # # ',
+        '                    ',
+        '      7             ',
+        '                    ',
+    ])
+    snake1 = Snake(True, XY(3, 2), XY(1, 2), 1)
+    snake1.grow_uncertain = False
+    snake1.length = 3
+    snake1.head_history = deque([XY(2, 2), XY(1, 2)])
+
+    snake2 = Snake(True, XY(9, 0), XY(7, 0), 2)
+    snake2.grow_uncertain = False
+    snake2.length = 3
+    snake2.head_history = deque([XY(8, 0), XY(7, 0)])
+
+    game_state = GameState(world, world_size, {1: snake1, 2: snake2}, 0)
+    game_state.my_snake = snake1
+    game_state.enemy_snake = snake2
+    return game_state, World(world_size.x, world_size.y, world)
+
+
+def test_snakes_separated():
+    game_state, world = two_separated_snakes()
+    region = MyRobotSnake.survival_region(game_state)
+    assert len(region) == 6 * 6 + 4 * 3
+    assert (1, 2) in region
+    assert MyRobotSnake.snakes_separated(game_state, region)
+
+    game_state.world_set(XY(9, 2), (0, 0))
+    region = MyRobotSnake.survival_region(game_state)
+    assert not MyRobotSnake.snakes_separated(game_state, region)
+
+
+def test_plan_survival_path():
+    game_state, world = two_separated_snakes()
+    region = MyRobotSnake.survival_region(game_state)
+    path = MyRobotSnake.plan_survival_path(game_state, region, None)
+
+    previous = (3, 2)
+    for position in path:
+        assert abs(position[0] - previous[0]) + abs(position[1] - previous[1]) == 1
+        assert position in region
+        previous = position
+    assert len(set(path)) == len(path)
+    # we can reuse our own body once it moves away, so the path covers almost whole region
+    assert len(path) >= len(region) - 4
+
+
+def test_survival_move_cached():
+    game_state, world = two_separated_snakes()
+    robot = MyRobotSnake(world)
+
+    move = robot.survival_move(game_state, None)
+    assert move is not None
+    plan = robot.survival_plan
+    first_step = plan.path[0]
+    assert first_step == (3 + move.x, 2 + move.y)
+
+    new_state, uncertainty = robot.advance_game(game_state, {1: move, 2: DIR_DOWN})
+    assert not uncertainty
+    new_state.my_snake = new_state.snakes_by_color[1]
+    new_state.enemy_snake = new_state.snakes_by_color[2]
+    second_step = plan.path[1]
+    move = robot.survival_move(new_state, None)
+    assert robot.survival_plan is plan
+    assert (first_step[0] + move.x, first_step[1] + move.y) == second_step
+
+
+def test_heuristic_cache_eviction():
+    cache = HeuristicCache(2)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    assert cache.get('a') == 1
+    cache.put('c', 3)
+    assert cache.get('b') is None
+    assert cache.get('a') == 1
+    assert cache.get('c') == 3
+    assert cache.hits == 3
+    assert cache.misses == 1
+
+    cache.reset_stats()
+    assert cache.hits == 0
+    assert cache.misses == 0
+
+
+def test_evaluate_cached():
+    game_state, world = two_distant_snakes()
+    robot = MyRobotSnake(world)
+    bfs = robot.bfs_food_and_partitions(game_state, None)
+    branch = bfs.position_stats[0]
+
+    expected = robot.heuristic(game_state, bfs, branch, 2)
+    assert robot.evaluate(game_state, bfs, branch, 2) == expected
+    assert robot.evaluate(GameState(game_state), bfs, branch, 2) == expected
+    assert robot.heuristic_cache.hits == 1
+    assert robot.heuristic_cache.misses == 1
+
+    assert robot.evaluate(game_state, bfs, branch, 3) == robot.heuristic(game_state, bfs, branch, 3)
+    game_state.my_snake.score += 1
+    assert robot.evaluate(game_state, bfs, branch, 2) == robot.heuristic(game_state, bfs, branch, 2)
+    assert robot.heuristic_cache.hits == 1
+    assert robot.heuristic_cache.misses == 3
+
+    # the world is not read by the heuristic, so a different position with the same snake stats hits the cache
+    moved, uncertainty = robot.advance_game(game_state, {game_state.my_snake.color: game_state.my_snake.direction})
+    moved.frame_no = game_state.frame_no
+    moved.my_snake.length = game_state.my_snake.length
+    moved.my_snake.score = game_state.my_snake.score
+    for color, snake in game_state.snakes_by_color.items():
+        moved.snakes_by_color[color].score = snake.score
+    assert robot.evaluate(moved, bfs, branch, 2) == robot.heuristic(moved, bfs, branch, 2)
+    assert robot.heuristic_cache.hits == 2
+
+
+def test_pack_heuristic():
+    heuristics = [
+        Heuristic(-1, -1, -1, -1000, 0.0, 0, 3),
+        Heuristic(-1, 0, 0, 5, 0.25, 10, 1),
+        Heuristic(0, -1, 0, 1000, 1.5, 100, -2),
+        Heuristic(0, 0, -1, 3, 2.0, 40, -2),
+        Heuristic(0, 0, 0, -7, 12.75, 40, -2),
+        Heuristic(0, 0, 0, 3, 0.5, 40, -2),
+        Heuristic(0, 0, 0, 3, 0.5, 41, -3),
+        Heuristic(0, 0, 0, 3, 0.5, 41, -1),
+        Heuristic(0, 1, 0, 3, 0.75, 2, -1),
+        Heuristic(1, 1, 0, 1003, 0.0, 1600, 0),
+    ]
+    for heuristic in heuristics:
+        assert unpack_heuristic(pack_heuristic(heuristic)) == heuristic
+    assert sorted(heuristics, key=pack_heuristic) == sorted(heuristics)
+
+
+def test_search_move_space_packed():
+    game_state, world = two_distant_snakes()
+    bfs = MyRobotSnake.bfs_food_and_partitions(game_state, None)
+
+    robot = MyRobotSnake(world)
+    score, move, explored_states, explored_all = robot.search_move_space(0, 2, game_state, None, None, bfs)
+
+    packed_robot = MyRobotSnake(world, packed_scores=True)
+    packed_score, packed_move, _, _ = packed_robot.search_move_space(0, 2, game_state, None, None, bfs)
+    assert isinstance(packed_score, int)
+    assert packed_move == move
+    assert unpack_heuristic(packed_score)._replace(food_score=0.0) == score._replace(food_score=0.0)
+
+
+def test_mcts_search_move_space():
+    random.seed(0)
+    game_state, world = three_snake_crossroads()
+    robot = MyRobotSnake(world, search_mode='mcts')
+    bfs = robot.bfs_food_and_partitions(game_state, None)
+
+    value, move, explored_states = robot.mcts_search_move_space(game_state, None, bfs, max_iterations=300)
+    assert move == DIR_RIGHT
+    assert 0.0 <= value <= 1.0
+    assert explored_states >= 300
+    assert robot.mcts_root.visits == 300
+
+
+def test_mcts_reuse_subtree():
+    random.seed(0)
+    game_state, world = three_snake_crossroads()
+    robot = MyRobotSnake(world, search_mode='mcts')
+    bfs = robot.bfs_food_and_partitions(game_state, None)
+    robot.mcts_search_move_space(game_state, None, bfs, max_iterations=300)
+    old_root = robot.mcts_root
+
+    joint_move, child = max(old_root.children.items(), key=lambda item: item[1].visits)
+    snake_directions = {color: moves[move_index]
+                        for color, moves, move_index in zip(old_root.colors, old_root.moves, joint_move)}
+    new_state, uncertainty = robot.advance_game(game_state, snake_directions)
+    child_visits = child.visits
+    assert child_visits > 0
+
+    grandchildren = {joint_move: grandchild.state.world for joint_move, grandchild in child.children.items()}
+    robot.mcts_search_move_space(new_state, None, bfs, max_iterations=10)
+    assert robot.mcts_root is child
+    assert child.visits == child_visits + 10
+    # the retained states don't refer to the states of the previous tick
+    assert all(child.children[joint_move].state.parent is new_state for joint_move in grandchildren)
+    assert all(child.children[joint_move].state.world == world for joint_move, world in grandchildren.items())
+
+    # tree can't be reused if the world differs from the prediction
+    new_state, uncertainty = robot.advance_game(new_state, snake_directions)
+    new_state.world_set(XY(4, 4), (5, 0))
+    robot.mcts_search_move_space(new_state, None, bfs, max_iterations=10)
+    assert robot.mcts_root.visits == 10
+
+
+def test_move_generator():
+    world, world_size = parse_world([
+        '  $1*1@1# ',
+        '      + % ',
+        '  @2      ',
+        '$2*2      ',
+    ])
+    snake1 = Snake(True, XY(3, 0), XY(1, 0), 1)
+    snake1.length = 3
+    snake1.head_history = deque([XY(2, 0), XY(1, 0)])
+
+    snake2 = Snake(True, XY(1, 2), XY(0, 3), 2)
+    snake2.length = 3
+    snake2.head_history = deque([XY(1, 3), XY(0, 3)])
+
+    game_state = GameState(world, world_size, {1: snake1, 2: snake2}, 0)
+    generator = MoveGenerator(game_state)
+
+    # wall above, stone to the right, dead body below, so only a single fallback move is generated
+    assert generator.moves(snake1) == (DIR_UP,)
+    # live bodies are not static obstacles
+    assert generator.moves(snake2) == (DIR_UP, DIR_RIGHT, DIR_LEFT)
+    assert generator.moves(snake2) is generator.moves(snake2)
+
+    snake1.head_history = deque()
+    assert generator.moves(snake1) == (DIR_LEFT,)
+
+
+def snake_fields(state: GameState):
+    return {color: (snake.alive, snake.head_pos, snake.tail_pos, snake.length, snake.grow, snake.grow_uncertain,
+                    snake.score, list(snake.head_history))
+            for color, snake in state.snakes_by_color.items()}
+
+
+def test_expand_all():
+    for game_state, world in (three_snake_crossroads(), two_distant_snakes(), two_separated_snakes()):
+        snake_moves = {color: MyRobotSnake.possible_moves(snake)
+                       for color, snake in game_state.snakes_by_color.items()}
+        children = MyRobotSnake.expand_all(game_state, snake_moves)
+        assert len(children) == 3 ** len(snake_moves)
+        for joint_move, (new_state, uncertainty) in children.items():
+            expected_state, expected_uncertainty = MyRobotSnake.advance_game(game_state,
+                                                                             dict(zip(snake_moves, joint_move)))
+            assert uncertainty == expected_uncertainty
+            assert serialize_world(new_state) == serialize_world(expected_state)
+            assert snake_fields(new_state) == snake_fields(expected_state)
+            assert new_state.frame_no == expected_state.frame_no
+
+
+def test_expand_all_shares_unchanged_snakes():
+    game_state, world = three_snake_crossroads()
+    children = MyRobotSnake.expand_all(game_state, {1: [DIR_RIGHT], 2: [DIR_LEFT, DIR_DOWN]})
+
+    new_state, uncertainty = children[DIR_RIGHT, DIR_LEFT]
+    assert new_state.snakes_by_color[3] is game_state.snakes_by_color[3]
+    assert new_state.snakes_by_color[1] is not game_state.snakes_by_color[1]
+    assert new_state.my_snake is new_state.snakes_by_color[1]
+    assert game_state.snakes_by_color[1].head_pos == XY(2, 2)
+
+
+def fingerprint(state: GameState) -> Tuple:
+    """Return a hashable value that is equal for equal game states"""
+    return (bytes(state.world), state.frame_no,
+            None if state.my_snake is None else state.my_snake.color,
+            None if state.enemy_snake is None else state.enemy_snake.color,
+            tuple((snake.color, snake.alive, snake.head_pos, snake.tail_pos, snake.length, snake.grow,
+                   snake.grow_uncertain, snake.score) for snake in state.snakes_by_color.values()))
+
+
+def test_derived_state_world_is_lazy():
+    game_state, world = three_snake_crossroads()
+    new_state, uncertainty = MyRobotSnake.advance_game(game_state, {1: DIR_RIGHT, 2: DIR_LEFT, 3: DIR_UP})
+    grand_child, uncertainty = MyRobotSnake.advance_game(new_state, {1: DIR_RIGHT, 2: DIR_LEFT, 3: DIR_UP})
+    assert new_state.parent is game_state
+    assert grand_child.parent is new_state
+    assert grand_child._world is None
+    bfs = MyRobotSnake(world).bfs_food_and_partitions(game_state, None)
+    MyRobotSnake.heuristic(grand_child, bfs, None, 2)
+    assert grand_child._world is None
+
+    # advancing from a full copy gives the same world
+    expected, uncertainty = MyRobotSnake.advance_game(GameState(new_state), {1: DIR_RIGHT, 2: DIR_LEFT, 3: DIR_UP})
+    assert grand_child.world == expected.world
+    assert grand_child._world is not None
+    assert new_state._world is not None
+    grand_child_fingerprint = fingerprint(grand_child)
+    assert grand_child_fingerprint == fingerprint(expected)
+
+    grand_child.world_set(XY(0, 0), (5, 0))
+    assert grand_child.world_get(XY(0, 0)) == (5, 0)
+    assert fingerprint(grand_child) != grand_child_fingerprint
+
+
+def test_derived_state_long_line():
+    game_state, world = three_snake_crossroads()
+    state = game_state
+    expected = bytearray(game_state.world)
+    for step in range(5 * sys.getrecursionlimit()):
+        state = state.derive([])
+        position = XY(step % game_state.world_size.x, 0)
+        state.world_set(position, (step % 9 + 1, 0))
+        expected[position.x] = GameState._encode_value((step % 9 + 1, 0))
+    # the world is materialised without recursing through the parents
+    assert state.world == expected
+
+
+def test_state_pool():
+    game_state, world = three_snake_crossroads()
+    pool = StatePool()
+    directions = {1: DIR_RIGHT, 2: DIR_LEFT, 3: DIR_UP}
+    expected, uncertainty = MyRobotSnake.advance_game(game_state, directions)
+    new_state, uncertainty = MyRobotSnake.advance_game(game_state, directions, pool)
+    assert new_state.world == expected.world
+    assert fingerprint(new_state) == fingerprint(expected)
+
+    pool.release(new_state)
+    # the moved snakes and the world buffer are returned to the pool, the shared snakes stay with the parent state
+    assert pool.game_states == [new_state]
+    assert sorted(snake.color for snake in pool.snakes) == [1, 2, 3]
+    assert len(pool.worlds) == 1
+    assert all(snake is not game_state_snake for snake in pool.snakes
+               for game_state_snake in game_state.snakes_by_color.values())
+
+    reused, uncertainty = MyRobotSnake.advance_game(game_state, directions, pool)
+    assert reused is new_state
+    assert reused.world == expected.world
+    assert len(pool) == 0
+    assert fingerprint(reused) == fingerprint(expected)
+    assert [list(snake.head_history) for snake in reused.snakes_by_color.values()] == \
+        [list(snake.head_history) for snake in expected.snakes_by_color.values()]
+
+
+def test_search_with_state_pool():
+    game_state, world = three_snake_crossroads()
+    robot = MyRobotSnake(world)
+    bfs = robot.bfs_food_and_partitions(game_state, None)
+    results = []
+    for i in range(2):
+        robot.heuristic_cache = HeuristicCache()
+        results.append(robot.search_move_space(0, 3, game_state, None, None, bfs))
+    # the states of the first search are reused by the second search and the result does not change
+    assert len(robot.state_pool) > 0
+    assert results[0] == results[1]
+
+
+def test_time_manager():
+    time_manager = TimeManager()
+    assert time_manager.start_tick(100.0, 1) == pytest.approx(0.75 / 9)
+    time_manager.end_tick(100.05)
+    assert time_manager.start_tick(100.1, 2) == pytest.approx(0.75 / 9)
+    time_manager.end_tick(100.15)
+
+    # frames come at 40 ms, one frame was missed
+    now = 100.1
+    for frame_no, interval in zip([3, 4, 6, 7, 8], [0.04, 0.04, 0.08, 0.04, 0.04]):
+        now += interval
+        time_limit = time_manager.start_tick(now, frame_no)
+        time_manager.end_tick(now + time_limit)
+    assert list(time_manager.intervals)[-5:] == pytest.approx([0.04] * 5)
+    assert time_limit == pytest.approx(0.75 * 0.04)
+
+    # replying takes 5 ms over the limit, which is kept as a margin
+    time_manager.end_tick(now + time_limit + 0.005)
+    assert time_manager.start_tick(now + 0.04, 8) == pytest.approx(0.75 * 0.04 - 0.005)
+
+    # the frame rate never goes below the ceiling
+    time_manager = TimeManager()
+    for tick in range(5):
+        time_manager.start_tick(tick * 10.0, tick)
+    assert time_manager.time_limit == pytest.approx(0.75 / 9)
+
+
+def test_time_manager_frame_rate_switch():
+    # the game runs at 9 frames per second and switches to 60 at frame 1024, we are called on the first frame after
+    # we reply and use the whole time limit; the frames we skip are counted in the frame numbers
+    def frame_time(frame: int) -> float:
+        return frame / 9.0 if frame < 1024 else 1024 / 9.0 + (frame - 1024) / 60.0
+
+    time_manager = TimeManager()
+    frame = 900
+    skipped = []
+    for tick in range(400):
+        now = frame_time(frame)
+        reply_time = now + time_manager.start_tick(now, frame)
+        time_manager.end_tick(reply_time)
+        next_frame = frame + 1
+        while frame_time(next_frame) < reply_time:
+            next_frame += 1
+        skipped.append(next_frame - frame - 1)
+        frame = next_frame
+    # frames are skipped only until a quarter of the interval samples are of the new frame rate
+    assert sum(1 for frames in skipped if frames > 0) <= TIME_SAMPLES // 4 + 1
+    assert sum(skipped[-200:]) == 0
+    assert time_manager.time_limit == pytest.approx(0.75 / 60)
+
+
+def test_time_manager_virtual_clock():
+    # the time limit is kept by a clock that advances only by our work, the frames arrive every 40 ms of wall time
+    time_manager = TimeManager()
+    clock_time = 0.0
+    for frame_no in range(1, 10):
+        time_limit = time_manager.start_tick(clock_time, frame_no, 100.0 + frame_no * 0.04)
+        clock_time += time_limit
+        time_manager.end_tick(clock_time)
+    assert time_limit == pytest.approx(0.75 * 0.04)
+
+
+def test_predict_iteration_time():
+    assert MyRobotSnake.predict_iteration_time([], []) is None
+    assert MyRobotSnake.predict_iteration_time([0.001], [4]) is None
+    assert MyRobotSnake.predict_iteration_time([0.001, 0.004], [4, 20]) == pytest.approx(0.02)
+    # the next iteration is not expected to be faster than the last one
+    assert MyRobotSnake.predict_iteration_time([0.001, 0.004], [20, 4]) == pytest.approx(0.004)
+
+
+def test_iterative_search_skips_doomed_iteration(monkeypatch):
+    game_state, world = two_distant_snakes()
+    robot = MyRobotSnake(world)
+    bfs = robot.bfs_food_and_partitions(game_state, None)
+    depths = []
+    search_move_space = robot.search_move_space
+
+    def search(depth, max_depth, *args, **kwargs):
+        if depth == 0:
+            depths.append(max_depth)
+        return search_move_space(depth, max_depth, *args, **kwargs)
+
+    monkeypatch.setattr(robot, 'search_move_space', search)
+    monkeypatch.setattr(MyRobotSnake, 'predict_iteration_time', staticmethod(
+        lambda times, states: 3600.0 if len(times) >= 2 else None))
+    score, move, explored_states = robot.iterative_search_move_space(game_state, time.monotonic() + 60, bfs)
+    assert depths == [1, 2]
+    assert move is not None
+
+
+@pytest.mark.parametrize('search_name', ['search_move_space', 'search_move_space_paranoid', 'search_move_space_maxn'])
+def test_search_partial_result(monkeypatch, search_name):
+    game_state, world = two_distant_snakes()
+    robot = MyRobotSnake(world)
+    bfs = robot.bfs_food_and_partitions(game_state, None)
+    score, best_move, explored_states, explored_all = getattr(robot, search_name)(0, 2, game_state, None, None, bfs)
+    first_move = next(move for move in robot.move_generator.moves(game_state.my_snake) if move != best_move)
+    head = game_state.my_snake.head_pos
+    first_head = XY(head.x + first_move.x, head.y + first_move.y)
+    search = getattr(robot, search_name)
+
+    def timing_out_search(depth, max_depth, state, *args, **kwargs):
+        # time runs out as soon as the search gets to the second root move
+        if depth == 1 and state.my_snake.head_pos != first_head:
+            raise SearchTimedOut()
+        return search(depth, max_depth, state, *args, **kwargs)
+
+    monkeypatch.setattr(robot, search_name, timing_out_search)
+    with pytest.raises(SearchTimedOut) as exc_info:
+        timing_out_search(0, 2, game_state, None, None, bfs, first_move=first_move)
+    assert exc_info.value.best_move == first_move
+    assert exc_info.value.best_score is not None
+    assert exc_info.value.explored_states > 0
+
+
+def test_iterative_search_uses_partial_result(monkeypatch):
+    game_state, world = two_distant_snakes()
+    robot = MyRobotSnake(world)
+    bfs = robot.bfs_food_and_partitions(game_state, None)
+    score, best_move, explored_states, explored_all = robot.search_move_space(0, 1, game_state, None, None, bfs)
+    search_move_space = robot.search_move_space
+    first_moves = []
+
+    def search(depth, max_depth, state, *args, first_move=None):
+        if depth == 0:
+            first_moves.append(first_move)
+            if max_depth == 3:
+                raise SearchTimedOut('partial score', DIR_LEFT, 10)
+        return search_move_space(depth, max_depth, state, *args, first_move=first_move)
+
+    monkeypatch.setattr(robot, 'search_move_space', search)
+    score, move, explored_states = robot.iterative_search_move_space(game_state, None, bfs)
+    assert first_moves[:2] == [None, best_move]
+    assert (score, move) == ('partial score', DIR_LEFT)
+
+
+def test_deadline_polling():
+    deadline = Deadline(time.monotonic() + 0.01)
+    polls = 0
+    clock_reads = 0
+    while True:
+        polls += 1
+        deadline.countdown -= 1
+        if deadline.countdown <= 0:
+            clock_reads += 1
+            if deadline.expired():
+                break
+    assert clock_reads < polls / 10
+    assert 0 <= deadline.overshoot < 0.005
+    assert deadline.expired()
+
+
+def test_deadline_node_clock():
+    clock = NodeClock(0.000001)
+    deadline = Deadline(0.001, clock)
+    polls = 1
+    while not deadline.node_expired():
+        polls += 1
+    # every node is counted on the clock, the deadline is noticed within a few nodes
+    assert clock.now() == pytest.approx(polls * 0.000001)
+    assert 1000 <= polls <= 1010
+
+    deadline = Deadline(0.1, clock)
+    for node in range(5):
+        assert not deadline.node_expired()
+    deadline.flush()
+    assert clock.now() == pytest.approx((polls + 5) * 0.000001)
+
+
+def test_iterative_search_node_clock():
+    game_state, world = three_snake_crossroads()
+    results = []
+    for budget in 0.002, 0.002, 0.02:
+        robot = MyRobotSnake(world, clock=NodeClock())
+        bfs = robot.bfs_food_and_partitions(game_state, None)
+        score, move, explored_states = robot.iterative_search_move_space(game_state, budget, bfs)
+        results.append((move, explored_states, robot.search_depth))
+    # the same budget explores the same nodes, regardless of the speed of the machine
+    assert results[0] == results[1]
+    assert results[2][1] > results[0][1]
+    assert results[2][2] >= results[0][2]
+
+
+def test_histogram():
+    histogram = Histogram((1, 2, 5, 10))
+    assert histogram.quantile(0.5) is None
+    for value in [0.5, 1, 1.5, 3, 3, 4, 7, 20]:
+        histogram.add(value)
+    assert histogram.counts == [2, 1, 3, 1, 1]
+    assert histogram.quantile(0.5) == 5
+    assert histogram.quantile(0.25) == 1
+    assert histogram.quantile(0.99) == 20
+    assert histogram.as_dict()['mean'] == pytest.approx(40 / 8)
+
+
+def test_telemetry_dump(tmp_path):
+    game_state, world = two_distant_snakes()
+    telemetry_path = str(tmp_path / 'telemetry.json')
+    robot = MyRobotSnake(world, telemetry_path=telemetry_path, telemetry_every=2)
+    robot.color = 1
+    robot.next_direction()
+    assert robot.telemetry.writer is None
+    assert not (tmp_path / 'telemetry.json').exists()
+    robot.next_direction()
+    robot.telemetry.writer.join()
+
+    with open(telemetry_path) as f:
+        telemetry = json.load(f)
+    assert telemetry['ticks'] == 2
+    histograms = telemetry['histograms']
+    assert histograms['tick_ms']['count'] == 2
+    assert histograms['bfs_distance']['count'] == 2
+    assert histograms['search_depth']['p50'] >= 1
+    assert sum(histograms['observe_ms']['counts']) == 2
+
+
+def test_tick_profiler(tmp_path):
+    game_state, world = two_distant_snakes()
+    robot = MyRobotSnake(world, profile_dir=str(tmp_path), profile_every=2)
+    robot.profiler.max_files = 2
+    robot.color = 1
+    for tick in range(4):
+        robot.next_direction()
+        assert len(list(tmp_path.iterdir())) <= 2
+    # collapsed stacks of the same tick may be written after the pstats, if sampled
+    assert (tmp_path / 'tick-000004.pstats').exists()
+    stats = pstats.Stats(str(tmp_path / 'tick-000004.pstats'))
+    assert any(name == 'observe_state_changes' for filename, line, name in stats.stats)
+
+    lines = TickProfiler.collapse({('asnake.py:next_direction', 'asnake.py:search_move_space'): 3,
+                                   ('asnake.py:next_direction',): 1}, 'tick-000007')
+    assert lines == ['tick-000007;asnake.py:next_direction 1',
+                     'tick-000007;asnake.py:next_direction;asnake.py:search_move_space 3']
+
+
+def test_next_direction_restores_global_state(tmp_path, monkeypatch):
+    game_state, world = two_distant_snakes()
+    robot = MyRobotSnake(world, profile_dir=str(tmp_path), profile_every=1, schedule_gc=True)
+    robot.color = 1
+    switch_interval = sys.getswitchinterval()
+
+    def fail(*args):
+        raise RuntimeError('broken tick')
+
+    monkeypatch.setattr(robot, 'observe_state_changes', fail)
+    with pytest.raises(RuntimeError):
+        robot.next_direction()
+    assert robot.gc_scheduler.idle.wait(5)
+    assert gc.isenabled()
+    assert sys.getswitchinterval() == switch_interval
+    assert (tmp_path / 'tick-000001.pstats').exists()
+
+
+def test_game_recorder(tmp_path):
+    game_state, world = two_distant_snakes()
+    robot = MyRobotSnake(world, record_dir=str(tmp_path))
+    robot.color = 1
+    directions = [robot.next_direction() for tick in range(3)]
+    robot.recorder.close()
+    path, = tmp_path.glob('*.rec')
+
+    with GameRecording(str(path)) as recording:
+        assert len(recording) == 3
+        frame = recording[2]
+        assert frame.frame_no == 2  # frames of the game since the bot joined
+        assert frame.color == 1
+        assert frame.world_size == game_state.world_size
+        assert bytes(frame.world) == bytes(robot.old_state.world)
+        assert [frame.move for frame in recording] == [XY(*direction) for direction in directions]
+        assert frame.search_depth == robot.search_depth
+        assert frame.tick_ms >= frame.search_ms > 0
+
+    # without the index, the frames are found by walking the records; an incomplete frame at the end is skipped
+    (tmp_path / (path.name + RECORD_INDEX_SUFFIX)).unlink()
+    size = path.stat().st_size
+    with open(str(path), 'ab') as f:
+        f.write(b'\x40\x00')
+    with GameRecording(str(path)) as recording:
+        assert [frame.frame_no for frame in recording] == [0, 1, 2]
+
+    # a file that ends with zeros after a crash has no more frames, with or without the index
+    with open(str(path), 'r+b') as f:
+        f.truncate(size)
+        f.seek(size)
+        f.write(bytes(2 * RECORD_FRAME_HEADER.size))
+    with GameRecording(str(path)) as recording:
+        assert [frame.frame_no for frame in recording] == [0, 1, 2]
+    with open(str(path) + RECORD_INDEX_SUFFIX, 'wb') as f:
+        f.write(RECORD_INDEX_ENTRY.pack(path.stat().st_size - RECORD_FRAME_HEADER.size))
+    with GameRecording(str(path)) as recording:
+        assert len(recording) == 0
+
+    recorder = GameRecorder(str(tmp_path / 'empty.rec'))
+    recorder.close()
+    with GameRecording(str(tmp_path / 'empty.rec')) as recording:
+        assert len(recording) == 0
+    with pytest.raises(ValueError):
+        GameRecording(str(tmp_path / ('empty.rec' + RECORD_INDEX_SUFFIX)))
+
+
+def test_game_recorder_game_over(tmp_path):
+    game_state, world = two_distant_snakes()
+    robot = MyRobotSnake(world, record_dir=str(tmp_path))
+    robot.color = 1
+    robot.next_direction()
+    recorder = robot.recorder
+    world.worlddata, world_size = parse_world([
+        '                                        ',
+        '  %1+1x1                                ',
+        '                                        ',
+        '                                        ',
+        '                                $2*2@2  ',
+        '                                      # ',
+        '                                        ',
+    ])
+    robot.next_direction()
+    assert robot.recorder is None
+    recorder.writer.join(5)
+    assert not recorder.writer.is_alive()
+    recorder.close()  # does nothing more, also at exit
+    with GameRecording(recorder.path) as recording:
+        assert [frame.frame_no for frame in recording] == [0, 1]
+
+
+def test_replay(tmp_path, monkeypatch):
+    game_state, world = two_distant_snakes()
+    robot = MyRobotSnake(world, record_dir=str(tmp_path))
+    robot.color = 1
+    for tick in range(3):
+        robot.next_direction()
+    robot.recorder.close()
+    path, = tmp_path.glob('*.rec')
+    with GameRecording(str(path)) as recording:
+        assert world_data(recording[0]) == world.worlddata
+        recorded_moves = [frame.move for frame in recording]
+
+    # the replaying bot doesn't record itself even when the environment asks bots to record
+    monkeypatch.setenv('ASNAKE_RECORD_DIR', str(tmp_path / 'replays'))
+    assert MyRobotSnake(world, record_dir='').recorder is None
+    ticks = replay(str(path), frame_interval=0.04)
+    assert not (tmp_path / 'replays').exists()
+    assert [tick.frame_no for tick in ticks] == [0, 1, 2]
+    assert [tick.recorded_move for tick in ticks] == recorded_moves
+    assert all(tick.latency_ms > 0 and tick.search_depth >= 1 for tick in ticks)
+
+    # with the time limits on a node clock, the replays explore the same nodes
+    runs = [replay(str(path), frame_interval=0.04, clock=NodeClock()) for run in range(2)]
+    assert [(tick.move, tick.search_depth) for tick in runs[0]] == [(tick.move, tick.search_depth) for tick in runs[1]]
+
+
+def test_replay_time_manager():
+    time_manager = ReplayTimeManager(0.04)
+    # ticks replayed back to back get the time limit of the virtual frame interval
+    now = 100.0
+    for frame_no in range(1, 6):
+        time_limit = time_manager.start_tick(now, frame_no)
+        now += 0.001
+        time_manager.end_tick(now)
+    assert time_limit == pytest.approx(0.75 * 0.04)
+    time_manager.start_tick(now, 6)
+    time_manager.end_tick(now + time_limit + 0.005)
+    assert time_manager.start_tick(now + time_limit + 0.006, 7) == pytest.approx(0.75 * 0.04 - 0.005)
+
+
+def test_memory_tracer():
+    game_state, world = two_distant_snakes()
+    robot = MyRobotSnake(world, trace_memory=True)
+    robot.color = 1
+    try:
+        robot.next_direction()
+        robot.next_direction()
+    finally:
+        tracemalloc.stop()
+    histograms = robot.telemetry.histograms
+    assert histograms['observe_peak_kib'].count == 2
+    assert histograms['search_peak_kib'].max > 0
+    assert histograms['bfs_blocks'].count == 2
+    # live objects are counted only every few ticks, at least the observed state and its snakes are alive
+    assert histograms['live_game_states'].count == 1
+    assert histograms['live_game_states'].max >= 1
+    assert histograms['live_snakes'].max >= 2
+
+
+def test_tick_profiler_env(monkeypatch, tmp_path):
+    game_state, world = two_distant_snakes()
+    monkeypatch.setenv('ASNAKE_PROFILE_EVERY', '7')
+    # an explicit argument wins over the environment
+    assert MyRobotSnake(world, profile_dir=str(tmp_path), profile_every=3).profiler.every == 3
+    assert MyRobotSnake(world, profile_dir=str(tmp_path)).profiler.every == 7
+    monkeypatch.delenv('ASNAKE_PROFILE_EVERY')
+    assert MyRobotSnake(world, profile_dir=str(tmp_path)).profiler.every == PROFILE_EVERY
+
+
+def test_memory_tracer_env(monkeypatch):
+    game_state, world = two_distant_snakes()
+    monkeypatch.setenv('ASNAKE_TRACE_MEMORY', '0')
+    assert MyRobotSnake(world).memory_tracer is None
+    assert MyRobotSnake(world, trace_memory=False).memory_tracer is None
+    monkeypatch.setenv('ASNAKE_TRACE_MEMORY', '1')
+    assert MyRobotSnake(world, trace_memory=False).memory_tracer is None
+    try:
+        assert MyRobotSnake(world).memory_tracer is not None
+    finally:
+        tracemalloc.stop()
+
+
+def test_gc_scheduler():
+    scheduler = GCScheduler()
+    try:
+        scheduler.start_tick()
+        assert not gc.isenabled()
+        scheduler.end_tick()
+        assert scheduler.idle.wait(5)
+        assert gc.isenabled()
+
+        scheduler.start_tick()
+        assert not gc.isenabled()
+    finally:
+        scheduler.end_tick()
+        scheduler.idle.wait(5)
+        gc.unfreeze()
+    assert gc.isenabled()
+
+
+def test_gc_scheduler_shared():
+    GCScheduler.shared().end_tick()  # starts the collector thread
+    assert GCScheduler.shared().idle.wait(5)
+    threads = threading.active_count()
+    robots = []
+    for i in range(5):
+        game_state, world = two_distant_snakes()
+        robot = MyRobotSnake(world, schedule_gc=True)
+        robot.color = 1
+        robot.next_direction()
+        robots.append(robot)
+    assert all(robot.gc_scheduler is GCScheduler.shared() for robot in robots)
+    assert threading.active_count() == threads
+    assert GCScheduler.shared().idle.wait(5)
+    assert gc.isenabled()
+
+
+def test_gc_scheduler_opt_in(monkeypatch):
+    game_state, world = two_distant_snakes()
+    monkeypatch.delenv('ASNAKE_SCHEDULE_GC', raising=False)
+    assert MyRobotSnake(world).gc_scheduler is None
+    monkeypatch.setenv('ASNAKE_SCHEDULE_GC', '0')
+    assert MyRobotSnake(world).gc_scheduler is None
+    monkeypatch.setenv('ASNAKE_SCHEDULE_GC', '1')
+    assert MyRobotSnake(world).gc_scheduler is GCScheduler.shared()
+    assert MyRobotSnake(world, schedule_gc=False).gc_scheduler is None